@@ -5,38 +5,145 @@
 
 import time
 import os
+import atexit
+import functools
+import shutil
+import threading
+import tempfile
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+import pyarrow as pa
+from pyarrow import csv as pacsv
+import pyarrow.parquet as pq
 from tqdm import tqdm
 from loguru import logger
-from rq_api import init_rq_api
+from config import MAX_WORKERS, OUTPUT_FORMAT
+from rq_api import get_price, init_rq_api, prime_instrument_cache
 from data_utils import (
+    TMP_SUFFIX,
+    atomic_write,
     get_stock_list_from_csv_folder,
     get_failed_stocks,
     get_failed_log_path,
+    get_log_file,
+    add_log_file_sink,
+    exception_error,
     write_failure_logs,
 )
-from factor_calculator import generate_factors_for_stock
+from factor_calculator import generate_factors_for_batch, generate_factors_for_stock
 
 # 常量定义
-RETRY_SLEEP_SECONDS = 1  # 串行重试时的延迟秒数
+RETRY_QPS = 1.0  # 重试时每秒最多开始处理的股票数（米筐API限流）
+RETRY_WORKERS = 2  # 重试时并行处理的线程数
+RETRY_ATTEMPTS = 3  # 重试时每只股票遇到异常最多尝试的次数
+RETRY_BACKOFF_BASE = 0.5  # 指数退避的初始等待（秒），每次失败后翻倍
+RETRY_BACKOFF_MAX = 5.0  # 指数退避的最长等待（秒）
+OUTPUT_FORMATS = ("csv", "feather", "parquet")  # 支持的输出格式，同时也是文件后缀
+STAGING_ROOT = "/dev/shm"  # 暂存目录所在的内存文件系统（不存在时使用系统临时目录）
+AGGREGATE_PARTITION_COL = "股票代码"  # 汇总模式下 Parquet 数据集的分区列
+AGGREGATE_COMPRESSION = "zstd"  # 汇总模式下 Parquet 文件的压缩算法
+AGGREGATE_PART_FILE = "part-0.parquet"  # 汇总模式下每个股票分区目录中的数据文件名
+FETCH_BATCH_SIZE = 50  # 批量模式下每次向米筐请求的股票数（越大请求次数越少，子进程内存占用越高）
+PREFETCH_BATCHES_PER_WORKER = 2  # 每个计算进程同时排队的股票块数（限制已算完待收集的结果占用内存）
+CSV_CHUNK_ROWS = 65536  # Arrow 流式写CSV时每批转换和写入的行数
+IDENTIFIER_COLUMNS = ("交易日期", "股票代码", "股票简称")  # 文本列，写CSV前不做数值转换
+PROGRESS_INTERVAL = 0.5  # 进度条及成功/失败统计的最短刷新间隔（秒）
+DRY_RUN_PROBE_DAYS = 14  # 试运行时探测米筐行情所取的自然日窗口（覆盖节假日）
+CGROUP_CPU_MAX_FILE = "/sys/fs/cgroup/cpu.max"  # cgroup v2 容器的CPU配额（"配额 周期" 或 "max 周期"）
+BLAS_THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)  # 限制计算子进程内数值库线程数的环境变量（多个进程各开满核线程会互相争抢）
+
+
+class TokenBucket:
+    """
+    令牌桶限速器
+
+    平均每秒最多放行 rate 次，最多允许 capacity 次突发。
+    与固定 sleep 不同，只有调用本身快于限速时才会等待。
+    线程安全，可用作上下文管理器: `with bucket: ...`
+    """
+
+    def __init__(self, rate, capacity=1):
+        if rate <= 0:
+            raise ValueError(f"令牌桶速率必须大于0: {rate}")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取得一个令牌，令牌不足时阻塞到补足为止"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._last) * self.rate
+                )
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
 
 
 def run_parallel_stock_processing(
-    csv_folder_path, output_folder_path, dataset_end_date, limit=None, max_workers=4
+    csv_folder_path,
+    output_folder_path,
+    dataset_end_date,
+    limit=None,
+    max_workers=MAX_WORKERS,
+    output_format=OUTPUT_FORMAT,
+    use_staging=False,
+    aggregate=False,
+    skip_existing=False,
+    float_format=None,
+    pin_workers=False,
 ):
     """
     【主函数】编排整个并行处理流程。
+
+    output_format: 输出格式，csv / feather / parquet
+    use_staging: 先写入内存文件系统中的暂存目录，全部完成后再整体拷贝到输出目录，
+        减少输出文件系统上的元数据开销；暂存期间结果占用内存，中途中断时已完成的文件仍会拷回
+    aggregate: 不再每只股票一个文件，而是把所有股票汇总写成一个按股票代码分区的
+        Parquet 数据集: {output_folder_path}/factors_{dataset_end_date}.parquet/
+    skip_existing: 断点续跑，不清空输出目录，只处理当日输出文件还不存在的股票
+        （按股票代码匹配，股票改名后旧名称的文件同样视为已完成）；
+        汇总模式下按数据集中的股票分区判断，未限制股票数量时一并删除已不在股票列表中的分区
+    float_format: CSV 浮点数格式（如 "%.6g"），默认 None 保留完整精度；
+        注意总市值等大数值用 "%.6g" 会丢失有效位
+    pin_workers: 计算进程各绑定一个CPU核心（仅 Linux 生效）
+    max_workers: 计算进程数，<= 0 时按本进程可用的CPU核心数自动确定
     """
     # --- 1. 准备阶段 ---
     logger.info("--- 开始准备阶段 ---")
-    
-    # 初始化米筐API
-    logger.info("初始化米筐API...")
-    if not init_rq_api():
-        logger.error("米筐API初始化失败，任务终止")
-        return
-    
+
+    if max_workers <= 0:
+        max_workers = available_cpu_count()
+        logger.info(f"自动确定计算进程数: {max_workers}")
+
     stock_list = get_stock_list_from_csv_folder(csv_folder_path, limit)
     if not stock_list:
         logger.error("股票列表为空，任务终止。")
@@ -45,12 +152,38 @@ def run_parallel_stock_processing(
     logger.info("准备输出目录...")
     os.makedirs(output_folder_path, exist_ok=True)
 
-    # 删除旧的CSV文件
-    for filename in os.listdir(output_folder_path):
-        if filename.endswith(".csv"):
-            file_path = os.path.join(output_folder_path, filename)
-            os.remove(file_path)
-    logger.warning(f"已清空目录: {output_folder_path}")
+    if skip_existing:
+        if aggregate and limit is None:
+            # 退市、调出股票池的股票不会再被重写，其旧分区要删掉，否则会混入当日数据集
+            _remove_stale_partitions(
+                _aggregate_dataset_path(output_folder_path, dataset_end_date),
+                {s["converted_code"] for s in stock_list},
+            )
+        # 扫描一次输出目录，已有当日输出文件的股票视为完成
+        done_codes = _existing_output_codes(
+            output_folder_path, dataset_end_date, output_format, aggregate
+        )
+        total_before = len(stock_list)
+        stock_list = [s for s in stock_list if s["converted_code"] not in done_codes]
+        logger.warning(
+            f"跳过已有输出的 {total_before - len(stock_list)} 只股票，剩余 {len(stock_list)} 只"
+        )
+        if not stock_list:
+            logger.success("所有股票都已有输出文件，无需处理")
+            return
+
+    # 确认还有要处理的股票后再登录米筐（断点续跑且已全部完成时不发起任何请求），
+    # 登录失败时不清空旧输出
+    logger.info("初始化米筐API...")
+    if not init_rq_api():
+        logger.error("米筐API初始化失败，任务终止")
+        return
+
+    if not skip_existing:
+        _clear_old_outputs(output_folder_path)
+
+    # 合约信息一次取齐并写入磁盘缓存，计算进程按块处理时直接读取
+    prime_instrument_cache([s["converted_code"] for s in stock_list], dataset_end_date)
 
     logger.warning("清理旧的失败日志...")
     failed_log_file = get_failed_log_path()
@@ -59,11 +192,31 @@ def run_parallel_stock_processing(
 
     # --- 2. 执行阶段 ---
     logger.success("--- 进入执行阶段 ---")
-    logger.success(f"准备并行处理 {len(stock_list)} 只股票，使用 {max_workers} 个线程")
+    logger.success(f"准备并行处理 {len(stock_list)} 只股票，使用 {max_workers} 个进程")
 
-    success_count, failed_stocks_list = _execute_parallel_processing(
-        stock_list, output_folder_path, dataset_end_date, max_workers
-    )
+    if use_staging:
+        staging_root = STAGING_ROOT if os.path.isdir(STAGING_ROOT) else None
+        write_folder = tempfile.mkdtemp(prefix="factors_", dir=staging_root)
+        logger.info(f"使用暂存目录: {write_folder}")
+    else:
+        write_folder = output_folder_path
+
+    try:
+        success_count, failed_stocks_list = _execute_parallel_processing(
+            stock_list,
+            write_folder,
+            dataset_end_date,
+            max_workers,
+            output_format,
+            aggregate=aggregate,
+            float_format=float_format,
+            pin_workers=pin_workers,
+        )
+    finally:
+        if use_staging:
+            logger.info(f"拷贝暂存文件到输出目录: {output_folder_path}")
+            shutil.copytree(write_folder, output_folder_path, dirs_exist_ok=True)
+            shutil.rmtree(write_folder, ignore_errors=True)
 
     # --- 3. 收尾阶段 ---
     logger.success("--- 进入收尾阶段 ---")
@@ -90,91 +243,654 @@ def run_parallel_stock_processing(
     logger.info("=" * 50)
 
 
+def available_cpu_count():
+    """
+    本进程实际可用的CPU核心数
+
+    优先取CPU亲和性（taskset / 容器 cpuset 限制后的核心），
+    再按 cgroup v2 的CPU配额向上取整截断（docker --cpus 等限制），至少为 1
+    """
+    if hasattr(os, "sched_getaffinity"):
+        count = len(os.sched_getaffinity(0))
+    else:
+        count = os.cpu_count() or 1  # macOS 等平台没有亲和性接口
+
+    try:
+        with open(CGROUP_CPU_MAX_FILE) as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            count = min(count, -(-int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass  # 非 Linux 或未限制配额
+
+    return max(1, count)
+
+
+def _existing_output_codes(
+    output_folder_path, dataset_end_date, output_format, aggregate=False
+):
+    """
+    扫描输出目录，返回当日已有输出的股票代码集合
+
+    逐股输出时匹配 {代码}-*-{日期}.{格式} 文件；汇总模式下匹配当日数据集中
+    已写完数据文件的 {分区列}={代码} 分区目录
+    """
+    if aggregate:
+        dataset_path = _aggregate_dataset_path(output_folder_path, dataset_end_date)
+        return set(_existing_partitions(dataset_path))
+
+    suffix = f"-{dataset_end_date}.{output_format}"
+    with os.scandir(output_folder_path) as entries:
+        return {
+            entry.name.split("-", 1)[0]
+            for entry in entries
+            if entry.name.endswith(suffix) and entry.is_file()
+        }
+
+
+def _existing_partitions(dataset_path):
+    """返回汇总数据集中已写完数据文件的分区 {股票代码: 分区目录}，数据集不存在时为空"""
+    prefix = f"{AGGREGATE_PARTITION_COL}="
+    try:
+        entries = os.scandir(dataset_path)
+    except FileNotFoundError:
+        return {}
+    with entries:
+        return {
+            entry.name[len(prefix):]: entry.path
+            for entry in entries
+            if entry.name.startswith(prefix)
+            and entry.is_dir()
+            and os.path.isfile(os.path.join(entry.path, AGGREGATE_PART_FILE))
+        }
+
+
+def _remove_stale_partitions(dataset_path, stock_codes):
+    """删除汇总数据集中不属于当前股票列表的分区（续跑时 _clear_old_outputs 不会执行）"""
+    stale = {
+        code: path
+        for code, path in _existing_partitions(dataset_path).items()
+        if code not in stock_codes
+    }
+    for path in stale.values():
+        shutil.rmtree(path)
+    if stale:
+        logger.warning(
+            f"删除 {len(stale)} 个已不在股票列表中的旧分区: {', '.join(sorted(stale)[:10])}"
+        )
+
+
+def _clear_old_outputs(output_folder_path):
+    """删除输出目录中的旧输出文件（scandir 的目录项自带类型信息，无需逐个 stat）"""
+    output_suffixes = tuple(
+        f".{fmt}{tmp}" for fmt in OUTPUT_FORMATS for tmp in ("", TMP_SUFFIX)
+    )
+    removed_count = 0
+    with os.scandir(output_folder_path) as entries:
+        for entry in entries:
+            if not entry.name.endswith(output_suffixes):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)  # 汇总模式写出的 Parquet 数据集目录
+            else:
+                os.unlink(entry.path)
+            removed_count += 1
+    logger.warning(f"已清空目录: {output_folder_path}（删除 {removed_count} 个旧文件）")
+
+
 def _execute_parallel_processing(
-    stock_list, output_folder, dataset_end_date, max_workers
+    stock_list,
+    output_folder,
+    dataset_end_date,
+    max_workers,
+    output_format="csv",
+    aggregate=False,
+    float_format=None,
+    pin_workers=False,
 ):
-    """【重构后】执行核心的并行处理逻辑，统一调用 _process_single_stock。"""
+    """
+    【重构后】执行核心的并行处理逻辑。
+
+    计算池为 spawn 方式启动、跨调用复用的进程池，每个子进程负责取数、因子计算并直接写盘，
+    只把 (是否成功, 错误信息) 传回主进程，因子数据不再经过进程间序列化；
+    CSV 格式化等写盘开销也随之分摊到各个子进程，不再集中在主进程中。
+    股票按 FETCH_BATCH_SIZE 分块交给计算池，每块内各米筐接口只请求一次；
+    同时在途的块数限制为 PREFETCH_BATCHES_PER_WORKER * max_workers，哪块先完成先收集哪块，
+    慢块不会阻塞其他块的进度统计。
+
+    aggregate=True 时子进程不写逐只文件，而是把各股票写成按股票代码分区的
+    Parquet 数据集中该股票自己的分区文件。
+    """
     success_count = 0
     failed_stocks_list = []
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_stock = {
-            executor.submit(
-                _process_single_stock, s, output_folder, dataset_end_date
-            ): s
-            for s in stock_list
-        }
+    compute_pool = _get_compute_pool(max_workers, pin_workers)
+    # 按块把股票分发给子进程：每块内各米筐接口只请求一次，
+    # 股票较少时缩小块大小，保证每个进程都能分到任务
+    batch_size = max(1, min(FETCH_BATCH_SIZE, -(-len(stock_list) // max_workers)))
+    batches = [
+        stock_list[i : i + batch_size]
+        for i in range(0, len(stock_list), batch_size)
+    ]
+    process_batch = functools.partial(
+        _stock_batch_task,
+        output_folder=output_folder,
+        dataset_end_date=dataset_end_date,
+        output_format=output_format,
+        aggregate=aggregate,
+        float_format=float_format,
+    )
+    pending_batches = iter(batches)
+    batch_futures = {}  # future -> 该块的股票列表
+
+    def submit_next_batch():
+        batch = next(pending_batches, None)
+        if batch is not None:
+            batch_futures[compute_pool.submit(process_batch, batch)] = batch
+
+    handled = set()  # 已收集结果的股票（id），进程池异常时用于找出剩余股票
+    with tqdm(
+        total=len(stock_list),
+        desc="处理",
+        unit="只",
+        mininterval=PROGRESS_INTERVAL,
+    ) as pbar:
+        last_postfix = time.monotonic()
+        try:
+            for _ in range(PREFETCH_BATCHES_PER_WORKER * max_workers):
+                submit_next_batch()
+
+            while batch_futures:
+                done, _ = wait(batch_futures, return_when=FIRST_COMPLETED)
+                for batch_future in done:
+                    batch = batch_futures.pop(batch_future)
+                    batch_results = batch_future.result()
+                    submit_next_batch()
+
+                    for stock_info, (is_success, error_message) in zip(
+                        batch, batch_results
+                    ):
+                        if is_success:
+                            success_count += 1
+                        else:
+                            failed_stocks_list.append(
+                                _failure_record(stock_info, error_message)
+                            )
+
+                        handled.add(id(stock_info))
+                        pbar.update(1)
+                        now = time.monotonic()
+                        if now - last_postfix >= PROGRESS_INTERVAL:
+                            last_postfix = now
+                            pbar.set_postfix_str(
+                                f"成功={success_count} 失败={len(failed_stocks_list)}",
+                                refresh=False,
+                            )
+        except Exception as e:
+            # 子进程异常退出等进程池层面的错误，剩余股票全部记为失败
+            remaining = [s for s in stock_list if id(s) not in handled]
+            logger.error(
+                f"进程池发生意外，剩余 {len(remaining)} 只股票未完成: {e}"
+            )
+            for batch_future in batch_futures:
+                batch_future.cancel()
+            shutdown_compute_pool()  # 进程池可能已损坏，下次调用时重建
+            error = exception_error(e)
+            failed_stocks_list.extend(_failure_record(s, error) for s in remaining)
+        # 关闭前补上最终统计
+        pbar.set_postfix_str(
+            f"成功={success_count} 失败={len(failed_stocks_list)}", refresh=False
+        )
+
+    # 结果按完成顺序收集，失败记录恢复为输入顺序，便于对照日志
+    stock_order = {s["converted_code"]: i for i, s in enumerate(stock_list)}
+    failed_stocks_list.sort(
+        key=lambda record: stock_order.get(record["stock_code"], len(stock_order))
+    )
+
+    if aggregate and success_count:
+        logger.success(
+            f"已汇总写入 {success_count} 只股票: "
+            f"{_aggregate_dataset_path(output_folder, dataset_end_date)}"
+        )
 
-        with tqdm(total=len(stock_list), desc="处理", unit="只") as pbar:
-            for future in as_completed(future_to_stock):
-                stock_info = future_to_stock[future]
-                try:
-                    is_success, error_message = future.result()
-                    if is_success:
-                        success_count += 1
-                    else:
-                        failed_stocks_list.append(
-                            {
-                                "stock_code": stock_info["converted_code"],
-                                "stock_name": stock_info["stock_name"],
-                                "error": error_message,
-                            }
-                        )
-                except Exception as e:
-                    # 捕获 future.result() 本身可能抛出的、更深层次的异常
-                    logger.error(
-                        f"处理 {stock_info['converted_code']} 时发生意外的 Future 异常: {e}"
-                    )
-                    failed_stocks_list.append(
-                        {
-                            "stock_code": stock_info["converted_code"],
-                            "stock_name": stock_info["stock_name"],
-                            "error": str(e),
-                        }
-                    )
-
-                pbar.update(1)
-                pbar.set_postfix(
-                    {"成功": success_count, "失败": len(failed_stocks_list)}
-                )
     return success_count, failed_stocks_list
 
 
-def _process_single_stock(stock_info, output_folder, dataset_end_date):
-    """【新】处理单只股票的核心逻辑，返回 (is_success, error_message)"""
+_compute_pool = None  # 跨多次调用复用的计算进程池，避免每次重新启动子进程
+_compute_pool_key = None  # 创建该进程池时的 (max_workers, pin_workers, 日志文件)
+
+
+def _get_compute_pool(max_workers, pin_workers=False):
+    """
+    返回可复用的计算进程池（spawn 启动），首次调用或参数变化时才创建
+
+    同一进程内按日期多次调用批量处理时，子进程保持常驻，只付一次启动和导入开销；
+    进程退出时由 atexit 关闭
+    """
+    global _compute_pool, _compute_pool_key
+    log_file = get_log_file()
+    key = (max_workers, pin_workers, log_file)
+    if _compute_pool is not None and _compute_pool_key == key:
+        return _compute_pool
+    shutdown_compute_pool()
+
+    mp_context = mp.get_context("spawn")
+    # 每个计算进程的数值库只用一个线程，并行度由进程数决定；
+    # spawn 出的子进程继承父进程环境变量，在子进程导入 numpy 之前生效（已手动设置的不覆盖）
+    for name in BLAS_THREAD_ENV_VARS:
+        os.environ.setdefault(name, "1")
+    worker_counter = mp_context.Value("i", 0) if pin_workers else None
+    _compute_pool = ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=mp_context,
+        initializer=_init_compute_worker,
+        initargs=(worker_counter, log_file),
+    )
+    _compute_pool_key = key
+    return _compute_pool
+
+
+@atexit.register
+def shutdown_compute_pool():
+    """关闭复用的计算进程池（未创建时什么也不做）"""
+    global _compute_pool, _compute_pool_key
+    if _compute_pool is not None:
+        _compute_pool.shutdown(wait=False, cancel_futures=True)
+        _compute_pool = None
+        _compute_pool_key = None
+
+
+def _init_compute_worker(worker_counter=None, log_file=None):
+    """
+    进程池初始化函数：子进程启动时登录一次米筐API，需要绑核时先绑定CPU核心
+
+    spawn 出的子进程不继承主进程的 loguru sink，主进程写了日志文件时，
+    子进程通过同一个 add_log_file_sink 追加写入该文件（不负责切分）。
+    登录失败不在这里抛出（否则整个进程池会被标记为损坏），
+    处理股票块时会再检查一次，仍失败则把该块记为失败
+    """
+    if log_file is not None:
+        add_log_file_sink(log_file, rotate=False)
+    if worker_counter is not None:
+        _pin_worker(worker_counter)
+    init_rq_api()
+
+
+def _pin_worker(worker_counter):
+    """按启动顺序把每个计算进程绑定到不同的CPU核心"""
+    if not hasattr(os, "sched_setaffinity"):
+        return  # macOS 等平台不支持绑核
+
+    with worker_counter.get_lock():
+        worker_id = worker_counter.value
+        worker_counter.value += 1
+
+    cpus = sorted(os.sched_getaffinity(0))
+    os.sched_setaffinity(0, {cpus[worker_id % len(cpus)]})
+
+
+def _aggregate_dataset_path(output_folder, dataset_end_date):
+    """汇总模式 Parquet 数据集的目录路径"""
+    return os.path.join(output_folder, f"factors_{dataset_end_date}.parquet")
+
+
+def _aggregate_table(factors_df):
+    """
+    将单只股票的因子数据转为 Arrow 表，整数列和全空列统一为 float64
+
+    同一列在不同股票间类型可能不同（如股东户数无缺失时为 int64、有缺失时为 double，
+    或整列为空时为 null）；各股票的分区文件 schema 必须一致，数据集才能整体读取。
+    """
+    table = pa.Table.from_pandas(factors_df, preserve_index=False)
+    schema = pa.schema(
+        [
+            pa.field(f.name, pa.float64())
+            if pa.types.is_integer(f.type) or pa.types.is_null(f.type)
+            else f
+            for f in table.schema
+        ]
+    )
+    return table.cast(schema)
+
+
+def _write_aggregate_partition(factors_df, output_folder, dataset_end_date):
+    """
+    将单只股票的因子数据写入按股票代码分区的 Parquet 数据集
+
+    每只股票恰好对应一个分区，直接写成 {分区列}={代码}/part-0.parquet，
+    各子进程写各自股票的分区，互不干扰；重跑时同名文件被原子替换。
+    """
+    table = _aggregate_table(factors_df)
+    if table.num_rows == 0:
+        return
+    dataset_path = _aggregate_dataset_path(output_folder, dataset_end_date)
+    stock_code = table.column(AGGREGATE_PARTITION_COL)[0].as_py()
+    partition_dir = os.path.join(dataset_path, f"{AGGREGATE_PARTITION_COL}={stock_code}")
+    os.makedirs(partition_dir, exist_ok=True)
+    file_path = os.path.join(partition_dir, AGGREGATE_PART_FILE)
+    # 临时文件以 "." 开头，中断残留时读取数据集会自动忽略
+    tmp_path = os.path.join(partition_dir, f".{AGGREGATE_PART_FILE}{TMP_SUFFIX}")
+    with atomic_write(file_path, tmp_path) as tmp_path:
+        pq.write_table(
+            table.drop_columns([AGGREGATE_PARTITION_COL]),
+            tmp_path,
+            compression=AGGREGATE_COMPRESSION,
+        )
+
+
+def _failure_record(stock_info, error_message):
+    """构造失败记录（error 可以是字符串或 exception_error 返回的元组）"""
+    return {
+        "stock_code": stock_info["converted_code"],
+        "stock_name": stock_info["stock_name"],
+        "error": error_message,
+    }
+
+
+def _write_factors_csv(factors_df, output_path, use_arrow=True, float_format=None):
+    """
+    将因子数据写入CSV文件
+
+    默认使用 pyarrow 的 C++ CSV 写入器，只打开一个 CSVWriter，
+    按 CSV_CHUNK_ROWS 行分批转换并写入，避免长历史数据一次性整表转换的内存峰值；
+    浮点列先格式化为与 pandas 相同的文本（见 _csv_arrow_table），输出与 to_csv 逐字节一致。
+    遇到需要转义的文本值（如含逗号的股票简称）时回退到 pandas。
+    指定 float_format 时直接使用 pandas（Arrow 写入只支持完整精度）。
+    """
+    if float_format is not None:
+        factors_df.to_csv(
+            output_path, encoding="utf-8", index=False, float_format=float_format
+        )
+        return
+
+    if use_arrow:
+        write_options = pacsv.WriteOptions(
+            include_header=True,
+            delimiter=",",
+            quoting_style="none",
+            quoting_header="none",
+        )
+        try:
+            first = _csv_arrow_table(factors_df.iloc[:CSV_CHUNK_ROWS])
+            with pacsv.CSVWriter(
+                str(output_path), first.schema, write_options=write_options
+            ) as writer:
+                writer.write_table(first)
+                for start in range(CSV_CHUNK_ROWS, len(factors_df), CSV_CHUNK_ROWS):
+                    chunk = factors_df.iloc[start : start + CSV_CHUNK_ROWS]
+                    writer.write_table(_csv_arrow_table(chunk, first.schema))
+            return
+        except pa.ArrowInvalid:
+            logger.debug(f"{output_path} 含需转义的文本，回退到 pandas 写入")
+
+    factors_df.to_csv(output_path, encoding="utf-8", index=False)
+
+
+def _csv_arrow_table(chunk, schema=None):
+    """
+    将一批因子数据转为写CSV用的 Arrow 表，浮点列转为文本列
+
+    Arrow 自己格式化浮点数时与 pandas 不同（1.0 写成 1、1e-05 写成 0.00001、
+    大数写成科学计数法），会破坏与历史输出的逐字节一致；这里用 numpy 整列转字符串
+    （与 pandas 写出的 repr 文本一致），NaN 记为空值（写出为空字段）。
+    schema: 首批转换得到的表结构，后续各批按它转换，保证列类型一致
+    """
+    table = pa.Table.from_pandas(chunk, preserve_index=False)
+    for i, (name, col) in enumerate(chunk.items()):
+        # 只处理 numpy 浮点列（可空整数列 Int64 转 numpy 时也会变成浮点，需排除）
+        if not (isinstance(col.dtype, np.dtype) and col.dtype.kind == "f"):
+            continue
+        values = col.to_numpy()
+        table = table.set_column(
+            i, name, pa.array(values.astype(str), mask=np.isnan(values))
+        )
+    if schema is not None:
+        table = table.cast(schema)
+    return table
+
+
+def _prep_for_csv(factors_df):
+    """
+    写CSV前整理数据：丢弃索引，object 类型的因子列转为数值类型，整数列压缩到最小整数类型
+
+    米筐偶尔返回 object 类型的数值列（混有 None），Arrow 写入路径无法处理，
+    会回退到逐元素格式化的 pandas 写入；能完整转换为数值的列在这里先转掉。
+    浮点列不做 float32 压缩：后复权价格、市值等数值超过 float32 的有效位数
+    （如 1234.5678 会变成 1234.5677），写出的文本会与原值不一致。
+    """
+    factors_df = factors_df.reset_index(drop=True)
+    for name in factors_df.select_dtypes(include="object").columns:
+        if name in IDENTIFIER_COLUMNS:
+            continue
+        try:
+            factors_df[name] = pd.to_numeric(factors_df[name])
+        except (ValueError, TypeError):
+            pass  # 含非数值文本，保持原样
+    for name in factors_df.select_dtypes(include="integer").columns:
+        factors_df[name] = pd.to_numeric(factors_df[name], downcast="integer")
+    return factors_df
+
+
+def _write_factors(
+    factors_df, output_path, output_format="csv", use_arrow=True, float_format=None
+):
+    """按指定格式写入因子数据（feather/parquet 均通过 pyarrow 写入，float_format 仅对 CSV 生效）"""
+    if output_format == "csv":
+        _write_factors_csv(
+            _prep_for_csv(factors_df), output_path, use_arrow=use_arrow, float_format=float_format
+        )
+    elif output_format == "feather":
+        factors_df.reset_index(drop=True).to_feather(output_path)
+    elif output_format == "parquet":
+        factors_df.to_parquet(
+            output_path,
+            engine="pyarrow",
+            compression="zstd",
+            compression_level=1,
+            index=False,
+        )
+    else:
+        raise ValueError(f"不支持的输出格式: {output_format}，可选: {OUTPUT_FORMATS}")
+
+
+def _output_filename(stock_info, dataset_end_date, output_format="csv"):
+    """单只股票输出文件的统一命名规则"""
+    return (
+        f"{stock_info['converted_code']}-{stock_info['stock_name']}"
+        f"-日线后复权及常用指标-{dataset_end_date}.{output_format}"
+    )
+
+
+def _save_stock_factors(
+    stock_info,
+    factors_df,
+    output_folder,
+    dataset_end_date,
+    output_format="csv",
+    use_arrow=True,
+    float_format=None,
+):
+    """按统一的文件命名规则保存单只股票的因子数据"""
+    output_path = os.path.join(
+        output_folder, _output_filename(stock_info, dataset_end_date, output_format)
+    )
+    # 先写临时文件再原子改名，进程中途被杀时不会留下看似完整的半截文件
+    with atomic_write(output_path) as tmp_path:
+        _write_factors(
+            factors_df,
+            tmp_path,
+            output_format=output_format,
+            use_arrow=use_arrow,
+            float_format=float_format,
+        )
+
+
+def _compute_single_stock(stock_info, dataset_end_date):
+    """
+    计算单只股票的因子数据（不写盘），返回 (factors_df, error_message)
+
+    会在进程池的子进程中执行，子进程首次调用时初始化米筐API。
+    """
     stock_symbol = stock_info["converted_code"]
-    stock_name = stock_info["stock_name"]
+
+    if not init_rq_api():
+        return None, "米筐API初始化失败"
 
     try:
         factors_df, error_message = generate_factors_for_stock(
             stock_symbol, dataset_end_date
         )
+        if error_message is None and factors_df is None:
+            error_message = "因子计算返回None"
+        return factors_df, error_message
 
-        if error_message is None and factors_df is not None:
-            # 成功
-            output_filename = f"{stock_symbol}-{stock_name}-日线后复权及常用指标-{dataset_end_date}.csv"
-            output_path = os.path.join(output_folder, output_filename)
-            factors_df.to_csv(output_path, encoding="utf-8", index=False)
+    except Exception as e:
+        # 未知异常
+        logger.error(f"处理 {stock_symbol} 时发生意外: {e}")
+        return None, exception_error(e)
 
-            return (True, None)
-        else:
+
+def _stock_batch_task(stock_infos, **kwargs):
+    """
+    计算池任务入口：处理一块股票，返回前等本进程排队中的日志写完
+
+    进程池关闭时子进程不执行 atexit，不在每块结束时等待的话，队列中最后的日志可能丢失
+    """
+    try:
+        return _process_stock_batch(stock_infos, **kwargs)
+    finally:
+        logger.complete()
+
+
+def _process_stock_batch(
+    stock_infos,
+    output_folder,
+    dataset_end_date,
+    output_format=OUTPUT_FORMAT,
+    aggregate=False,
+    float_format=None,
+):
+    """
+    批量处理一块股票（计算并写盘），按输入顺序返回 [(is_success, error_message), ...]
+
+    在进程池的子进程中执行，整块股票共用一次米筐批量请求；每只股票算完即在子进程内写盘，
+    只把处理状态传回主进程。米筐API已由进程池初始化函数登录，这里只在其失败时重试登录。
+    """
+    if not init_rq_api():
+        return [(False, "米筐API初始化失败")] * len(stock_infos)
+
+    symbols = [s["converted_code"] for s in stock_infos]
+    try:
+        batch_results = generate_factors_for_batch(symbols, dataset_end_date)
+    except Exception as e:
+        logger.error(f"批量处理 {len(symbols)} 只股票时发生意外: {e}")
+        return [(False, exception_error(e))] * len(stock_infos)
+
+    results = []
+    for stock_info in stock_infos:
+        factors_df, error_message = batch_results[stock_info["converted_code"]]
+        if error_message is None and factors_df is None:
+            error_message = "因子计算返回None"
+        if error_message is not None:
             # 已知失败
-            return (False, error_message or "因子计算返回None")
+            results.append((False, error_message))
+            continue
+        results.append(
+            _write_stock_result(
+                stock_info,
+                factors_df,
+                output_folder,
+                dataset_end_date,
+                output_format=output_format,
+                aggregate=aggregate,
+                float_format=float_format,
+            )
+        )
+    return results
+
+
+def _write_stock_result(
+    stock_info,
+    factors_df,
+    output_folder,
+    dataset_end_date,
+    output_format=OUTPUT_FORMAT,
+    aggregate=False,
+    use_arrow=True,
+    float_format=None,
+):
+    """写入单只股票的因子数据，返回 (is_success, error_message)"""
+    try:
+        if aggregate:
+            _write_aggregate_partition(factors_df, output_folder, dataset_end_date)
+        else:
+            _save_stock_factors(
+                stock_info,
+                factors_df,
+                output_folder,
+                dataset_end_date,
+                output_format=output_format,
+                use_arrow=use_arrow,
+                float_format=float_format,
+            )
+        return (True, None)
 
     except Exception as e:
         # 未知异常
-        logger.error(f"处理 {stock_symbol} 时发生意外: {e}")
-        return (False, str(e))
+        logger.error(f"写入 {stock_info['converted_code']} 时发生意外: {e}")
+        return (False, exception_error(e))
+
+
+def _process_single_stock(
+    stock_info,
+    output_folder,
+    dataset_end_date,
+    use_arrow=True,
+    output_format=OUTPUT_FORMAT,
+    float_format=None,
+):
+    """【新】处理单只股票的核心逻辑（计算并写盘），返回 (is_success, error_message)"""
+    factors_df, error_message = _compute_single_stock(stock_info, dataset_end_date)
+    if error_message is not None:
+        # 已知失败
+        return (False, error_message)
+
+    return _write_stock_result(
+        stock_info,
+        factors_df,
+        output_folder,
+        dataset_end_date,
+        output_format=output_format,
+        use_arrow=use_arrow,
+        float_format=float_format,
+    )
 
 
-def retry_failed_stocks(output_folder_path, dataset_end_date):
-    """【重构后】串行重试处理失败的股票"""
+def retry_failed_stocks(
+    output_folder_path,
+    dataset_end_date,
+    output_format=OUTPUT_FORMAT,
+    qps=RETRY_QPS,
+    float_format=None,
+    max_workers=RETRY_WORKERS,
+):
+    """
+    【重构后】并行重试处理失败的股票
+
+    qps: 每秒最多开始处理的股票数，由各线程共享的令牌桶限速
+    float_format: CSV 浮点数格式，默认 None 保留完整精度
+    max_workers: 并行重试的线程数，<= 0 时按本进程可用的CPU核心数自动确定；
+        单只股票遇到异常时按指数退避再试，最多 RETRY_ATTEMPTS 次（数据为空等确定性失败不再重复请求）
+    """
     failed_stocks = get_failed_stocks()
     if not failed_stocks:
         logger.success("所有股票都已成功处理，无需重试")
         return
 
-    logger.info(f"找到 {len(failed_stocks)} 只失败股票，开始串行重试")
+    if max_workers <= 0:
+        max_workers = available_cpu_count()
+    logger.info(f"找到 {len(failed_stocks)} 只失败股票，开始并行重试（{max_workers} 个线程）")
 
     # 准备环境
     failed_log_file = get_failed_log_path()
@@ -185,22 +901,30 @@ def retry_failed_stocks(output_folder_path, dataset_end_date):
     success_count = 0
     failed_stocks_list = []
 
-    for stock_info in tqdm(failed_stocks, desc="重试", unit="只"):
-        is_success, error_message = _process_single_stock(
-            stock_info, output_folder_path, dataset_end_date
-        )
+    bucket = TokenBucket(qps)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(
+                _retry_single_stock,
+                stock_info,
+                output_folder_path,
+                dataset_end_date,
+                bucket,
+                output_format=output_format,
+                float_format=float_format,
+            )
+            for stock_info in failed_stocks
+        ]
+        for _ in tqdm(as_completed(futures), total=len(futures), desc="重试", unit="只"):
+            pass
 
+    # 按原顺序汇总结果
+    for stock_info, future in zip(failed_stocks, futures):
+        is_success, error_message = future.result()
         if is_success:
             success_count += 1
         else:
-            failed_stocks_list.append(
-                {
-                    "stock_code": stock_info["converted_code"],
-                    "stock_name": stock_info["stock_name"],
-                    "error": error_message,
-                }
-            )
-        time.sleep(RETRY_SLEEP_SECONDS)
+            failed_stocks_list.append(_failure_record(stock_info, error_message))
 
     # 收尾：记录汇总报告
     failed_count = len(failed_stocks_list)
@@ -217,3 +941,95 @@ def retry_failed_stocks(output_folder_path, dataset_end_date):
         f"成功: {success_count} 只，失败: {failed_count} 只，总计: {len(failed_stocks)} 只"
     )
     logger.info("=" * 50)
+
+
+def _retry_single_stock(
+    stock_info,
+    output_folder,
+    dataset_end_date,
+    bucket,
+    output_format=OUTPUT_FORMAT,
+    float_format=None,
+):
+    """
+    重试单只股票，返回 (is_success, error_message)
+
+    每次尝试前从令牌桶取令牌；只有意外异常（网络错误、限流等，因子计算和写盘中的异常
+    都由 exception_error 记为元组）才按指数退避再试，已知的数据缺失类失败直接返回。
+    """
+    for attempt in range(RETRY_ATTEMPTS):
+        with bucket:
+            is_success, error_message = _process_single_stock(
+                stock_info,
+                output_folder,
+                dataset_end_date,
+                output_format=output_format,
+                float_format=float_format,
+            )
+        if is_success or not isinstance(error_message, tuple):
+            break
+        if attempt + 1 < RETRY_ATTEMPTS:
+            delay = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2**attempt)
+            logger.warning(
+                f"{stock_info['converted_code']} 第 {attempt + 1} 次重试失败，{delay:.1f} 秒后再试"
+            )
+            time.sleep(delay)
+    return is_success, error_message
+
+
+def dry_run_check(
+    csv_folder_path,
+    output_folder_path,
+    dataset_end_date,
+    limit=None,
+    output_format=OUTPUT_FORMAT,
+    aggregate=False,
+):
+    """
+    试运行：只检查数据目录和米筐连通性，不启动计算进程、不写任何文件
+
+    扫描一次原始数据目录得到股票列表，统计输出目录中已完成的股票，
+    再用列表中第一只股票请求一次近期行情，确认米筐账号可用、数据日期有行情。
+
+    Returns:
+        bool: 检查是否全部通过
+    """
+    if not os.path.isdir(csv_folder_path):
+        logger.error(f"原始数据目录不存在: {csv_folder_path}")
+        return False
+
+    stock_list = get_stock_list_from_csv_folder(csv_folder_path, limit)
+    if not stock_list:
+        logger.error(f"原始数据目录中没有可处理的股票文件: {csv_folder_path}")
+        return False
+    logger.info(f"原始数据目录: {csv_folder_path}，共 {len(stock_list)} 只股票")
+
+    if os.path.isdir(output_folder_path):
+        done_codes = _existing_output_codes(
+            output_folder_path, dataset_end_date, output_format, aggregate
+        )
+        remaining = sum(s["converted_code"] not in done_codes for s in stock_list)
+        logger.info(f"输出目录已有 {len(done_codes)} 只股票的当日输出，续跑还需处理 {remaining} 只")
+    else:
+        logger.info(f"输出目录尚不存在，正式运行时会创建: {output_folder_path}")
+
+    if not init_rq_api():
+        return False
+
+    probe_code = stock_list[0]["converted_code"]
+    end_date = pd.Timestamp(dataset_end_date)
+    start_date = end_date - pd.Timedelta(days=DRY_RUN_PROBE_DAYS)
+    try:
+        prices = get_price(
+            probe_code, start_date, end_date, fields=["close"], adjust_type="none"
+        )
+    except Exception as e:
+        logger.error(f"米筐行情探测失败（{probe_code}）: {e}")
+        return False
+    if prices is None or len(prices) == 0:
+        logger.warning(f"米筐没有返回 {probe_code} 在 {dataset_end_date} 前 {DRY_RUN_PROBE_DAYS} 天的行情")
+        return False
+
+    last_date = pd.Timestamp(prices.index.get_level_values(-1).max())
+    logger.success(f"米筐行情探测通过: {probe_code} 最新交易日 {last_date:%Y%m%d}")
+    return True
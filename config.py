@@ -1,9 +1,10 @@
 """
 因子处理配置模块
-统一管理路径配置、YAML配置加载和工具函数
+统一管理路径配置、并行与输出配置，以及因子配置（模块内常量，导入时构建一次）
 """
 
 import os
+from types import MappingProxyType
 
 # ==================== 路径配置 ====================
 # 数据根目录 - 遵循数据和代码分离的开发范式
@@ -17,6 +18,16 @@ ENHANCED_DATA_DIR = os.path.join(
 CACHE_DIR = os.path.join(DATA_ROOT, "dnn_model", "cache")
 REPORTS_DIR = os.path.join(DATA_ROOT, "dnn_model", "comparison_reports")
 
+# ==================== 并行配置 ====================
+# 计算进程数：每个进程串行发起米筐请求，耗时主要在网络往返，
+# 增加进程数可让更多请求同时在途；上限取决于米筐账号的并发配额
+MAX_WORKERS = 4
+
+# ==================== 输出配置 ====================
+# 因子文件输出格式: csv / feather / parquet
+# parquet（zstd 压缩）体积最小、写入最快；下游对比脚本目前仍读取 csv，切换前需确认下游已支持
+OUTPUT_FORMAT = "csv"
+
 # ==================== 统一配置字典 ====================
 _CONFIG_DATA = {
     "factor_name_mapping": {
@@ -171,11 +182,23 @@ _CONFIG_DATA = {
 
 
 # ==================== 配置加载 ====================
+# 只读视图：内层字典包装为 MappingProxyType，列表转为元组，
+# 外部误改配置会直接报错，也省去每次调用复制字典的开销
+_CONFIG_FROZEN = MappingProxyType(
+    {
+        key: MappingProxyType(value) if isinstance(value, dict) else tuple(value)
+        for key, value in _CONFIG_DATA.items()
+    }
+)
+
+
 def get_config():
     """
-    返回统一的配置字典
+    返回统一的配置（只读）
+
+    因子列表为元组，传给 pandas 索引或米筐接口前需先转为 list。
 
     Returns:
-        dict: 配置字典
+        MappingProxyType: 只读配置映射
     """
-    return _CONFIG_DATA.copy()  # 返回副本以防止外部修改
+    return _CONFIG_FROZEN
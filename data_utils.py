@@ -5,11 +5,76 @@
 
 import os
 import re
-from datetime import datetime
+import json
+import pickle
+import contextlib
+import functools
+import threading
+from datetime import date, datetime
+import numpy as np
 import pandas as pd
-
-# 全局标志：用于控制因子统计表格只打印一次
-_factor_summary_printed = False
+from loguru import logger
+
+try:
+    import orjson  # 可选依赖：C 实现的 JSON 序列化，比标准库快数倍
+except ImportError:
+    orjson = None
+
+# 事件标志：用于控制因子统计表格只打印一次（多线程下也只打印一次）
+_factor_summary_printed = threading.Event()
+_factor_summary_lock = threading.Lock()
+
+# 本模块所在目录（失败日志写在其下的 log/ 目录）
+_THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LOG_ROTATION = "500 MB"  # 任务日志文件按大小切分
+LOG_RETENTION = "30 days"  # 切分出的旧日志保留时长
+_log_file = None  # 本进程通过 add_log_file_sink 写入的日志文件，计算子进程据此写入同一文件
+
+TMP_SUFFIX = ".tmp"  # 写盘时的临时文件后缀，写完后原子改名为正式文件名
+
+# 原始数据文件名格式: "000001.SZ-股票名称-日线后复权及常用指标-20250718.csv"
+STOCK_FILENAME_PATTERN = re.compile(
+    r"([0-9]{6}\.[A-Z]{2})-(.+?)-日线后复权及常用指标-(\d{8})\.csv"
+)
+
+# 交易所后缀映射: 原始数据后缀 -> 米筐后缀
+EXCHANGE_SUFFIX_MAP = {"SZ": "XSHE", "SH": "XSHG", "BJ": "BJSE"}
+
+# 米筐后缀 -> 交易所名称（按顺序匹配，均不命中为 "未知"）
+EXCHANGE_NAME_MAP = {".XSHG": "上交所", ".XSHE": "深交所", ".BJSE": "北交所"}
+
+# 因子分类规则（按列名关键字匹配）
+BASIC_INFO_COLUMNS = ["交易日期", "股票代码", "股票简称"]
+DERIVED_FACTOR_PATTERN = re.compile("涨跌|振幅|成交额|换手率|流通股")
+FLOW_FACTOR_PATTERN = re.compile("主买|主卖")
+FUNDAMENTAL_FACTOR_PATTERN = re.compile(
+    "市盈率|市净率|市销率|股息率|市值|账面市值比"
+    "|息税前利润|息税折旧摊销前利润|每股息税前利润|净资产收益率"
+)
+SHAREHOLDER_FACTOR_PATTERN = re.compile("股东|户均")
+
+# 错误分类规则：按顺序匹配，先命中者优先（与原 if/elif 顺序一致）
+ERROR_CATEGORY_RULES = [
+    (
+        re.compile(r"(?=.*instruments\(\))(?=.*未能找到股票)", re.S),
+        "米筐API的 `instruments()` 函数未能找到股票的基本信息",
+    ),
+    (re.compile(r"get_capital_flow\(\)"), "米筐API的 get_capital_flow() 返回 None"),
+    (
+        re.compile(r"(?=.*get_price\(\))(?=.*后复权)", re.S),
+        "米筐API的 get_price() 返回空数据(后复权)",
+    ),
+    (
+        re.compile(r"(?=.*get_price\(\))(?=.*未复权)", re.S),
+        "米筐API的 get_price() 返回空数据(未复权)",
+    ),
+    (re.compile(r"get_turnover_rate\(\)"), "米筐API的 get_turnover_rate() 返回 None"),
+    (re.compile(r"get_shares\(\)"), "米筐API的 get_shares() 返回 None"),
+    (re.compile(r"get_vwap\(\)"), "米筐API的 get_vwap() 返回 None"),
+    (re.compile(r"get_factor\(\)"), "米筐API的 get_factor() 返回空数据"),
+    (re.compile(r"get_holder_number\(\)"), "米筐API的 get_holder_number() 返回空数据"),
+]
 
 
 def parse_stock_info_from_filename(filename):
@@ -18,8 +83,7 @@ def parse_stock_info_from_filename(filename):
     输入: "000001.SZ-股票名称-日线后复权及常用指标-20250718.csv"
     输出: ("000001.SZ", "股票名称", "20250718")
     """
-    pattern = r"([0-9]{6}\.[A-Z]{2})-(.+?)-日线后复权及常用指标-(\d{8})\.csv"
-    match = re.match(pattern, filename)
+    match = STOCK_FILENAME_PATTERN.match(filename)
     if match:
         return match.group(1), match.group(2), match.group(3)
     return None, None, None
@@ -30,32 +94,42 @@ def convert_stock_code(original_code):
     转换股票代码格式
     SZ -> XSHE, SH -> XSHG, BJ -> BJSE
     """
-    if original_code.endswith(".SZ"):
-        return original_code.replace(".SZ", ".XSHE")
-    elif original_code.endswith(".SH"):
-        return original_code.replace(".SH", ".XSHG")
-    elif original_code.endswith(".BJ"):
-        return original_code.replace(".BJ", ".BJSE")
-    else:
+    code, dot, suffix = original_code.rpartition(".")
+    converted_suffix = EXCHANGE_SUFFIX_MAP.get(suffix)
+    if not dot or converted_suffix is None:
         return None  # 其他格式暂不处理
+    return f"{code}.{converted_suffix}"
 
 
 def get_stock_list_from_csv_folder(csv_folder_path, limit=None):
     """
     从CSV文件夹获取股票列表
+
+    目录扫描和文件名解析结果按 (csv_folder_path, 目录修改时间, limit) 缓存，
+    同一进程内重复调用不再重新扫描，目录中增加、删除或改名文件后会重新扫描；
+    返回的每只股票信息都是副本，调用方可自由修改。
     """
-    stock_list = []
+    mtime_ns = os.stat(csv_folder_path).st_mtime_ns
+    return [dict(info) for info in _scan_stock_list(csv_folder_path, mtime_ns, limit)]
 
-    for filename in os.listdir(csv_folder_path):
-        if not filename.endswith('.csv'):
-            continue
-        original_code, stock_name, date = parse_stock_info_from_filename(filename)
 
-        if original_code and stock_name:
-            # 转换股票代码
-            converted_code = convert_stock_code(original_code)
+@functools.lru_cache(maxsize=8)
+def _scan_stock_list(csv_folder_path, mtime_ns, limit=None):
+    """扫描CSV文件夹并解析股票信息（带缓存，mtime_ns 只参与缓存键），返回元组"""
+    stock_list = []
 
-            if converted_code:  # 处理SZ、SH和BJ股票
+    with os.scandir(csv_folder_path) as entries:
+        for entry in entries:
+            name = entry.name
+            # is_file() 直接使用目录项自带的类型信息，普通文件无需额外 stat
+            if not name.endswith(".csv") or not entry.is_file():
+                continue
+            original_code, stock_name, date = parse_stock_info_from_filename(name)
+            if not (original_code and stock_name):
+                continue
+            # 只处理SZ、SH和BJ股票，其他后缀被过滤掉
+            converted_code = convert_stock_code(original_code)
+            if converted_code:
                 stock_list.append(
                     {
                         "original_code": original_code,
@@ -69,20 +143,92 @@ def get_stock_list_from_csv_folder(csv_folder_path, limit=None):
     if limit:
         stock_list = stock_list[:limit]
 
-    return stock_list
+    return tuple(stock_list)
+
+
+def add_log_file_sink(log_file, rotate=True):
+    """
+    把 loguru 日志追加写入 log_file，主进程和计算子进程共用这一个入口
+
+    enqueue=True: 日志先进入队列，由后台线程写文件，调用 logger 时不等待磁盘写入。
+    多个进程以追加方式写同一个文件，只由主进程负责切分和清理（rotate=True），
+    子进程传 rotate=False，避免各进程各自切分同一个文件。
+    """
+    global _log_file
+    rotation = {"rotation": LOG_ROTATION, "retention": LOG_RETENTION} if rotate else {}
+    logger.add(log_file, encoding="utf-8", enqueue=True, **rotation)
+    _log_file = log_file
+
+
+def get_log_file():
+    """返回本进程通过 add_log_file_sink 写入的日志文件，未设置时为 None"""
+    return _log_file
+
+
+@contextlib.contextmanager
+def atomic_write(path, tmp_path=None):
+    """
+    原子写文件：在 with 块中写入给出的临时路径，正常结束后改名为正式文件
+
+    进程中途被杀时不会留下看似完整的半截文件；写入出错时删除临时文件，异常继续抛出。
+
+    Args:
+        path: 正式文件路径
+        tmp_path: 临时文件路径（须与 path 在同一文件系统），默认为 path + TMP_SUFFIX
+
+    用法:
+        with atomic_write(output_path) as tmp_path:
+            df.to_csv(tmp_path)
+    """
+    if tmp_path is None:
+        tmp_path = path + TMP_SUFFIX
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_pickle_cache(path, default=None):
+    """
+    读取 pickle 缓存文件，不存在或读不出时返回 default
+
+    旧版本的库（rqdatac、pandas、numpy 等）写出的缓存反序列化时可能抛出
+    AttributeError、ImportError 等，一律视为缓存未命中，由调用方重新生成
+    """
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        return default
+
+
+def save_pickle_cache(path, obj):
+    """将对象原子写入 pickle 缓存文件（自动创建所在目录），失败时抛出异常由调用方处理"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_write(path) as tmp_path:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
 
 
 def get_failed_log_path():
     """
-    获取失败日志文件路径
+    获取失败日志文件路径（当天）
+
+    路径按日期缓存：跨过午夜后自动切换到新一天的文件。
     
     Returns:
         str: 失败日志文件的完整路径
     """
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    log_dir = os.path.join(current_dir, "log")
-    today = datetime.now().strftime("%Y%m%d")
-    return os.path.join(log_dir, f"failed_stocks_{today}.txt")
+    return _failed_log_path_for(date.today())
+
+
+@functools.lru_cache(maxsize=1)
+def _failed_log_path_for(day):
+    """拼接指定日期的失败日志文件路径（带缓存）"""
+    return os.path.join(_THIS_DIR, "log", f"failed_stocks_{day:%Y%m%d}.jsonl")
 
 
 def get_failed_stocks():
@@ -96,38 +242,52 @@ def get_failed_stocks():
 
     if os.path.exists(failed_log_file):
         try:
-            failed_stocks = []
-            with open(failed_log_file, "r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    # 新格式: stock_code|stock_name|error|timestamp
-                    parts = line.split("|")
-                    if len(parts) >= 2:
-                        stock_code = parts[0]
-                        stock_name = parts[1]
-                        failed_stocks.append(
-                            {
-                                "converted_code": stock_code,
-                                "stock_name": stock_name,
-                            }
-                        )
-
-            if failed_stocks:
-                from loguru import logger
-
-                logger.info(f"从日志文件读取到 {len(failed_stocks)} 只失败股票")
-                return failed_stocks
-        except Exception as e:
-            from loguru import logger
-
+            # 一次读入整个文件再按行切分，避免逐行读取的开销
+            with open(failed_log_file, "rb") as f:
+                lines = f.read().splitlines()
+        except OSError as e:
             logger.warning(f"读取失败日志文件出错: {e}")
+            lines = []
+
+        failed_stocks = []
+        for line_no, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            # 每行一条 JSON 记录: stock_code, stock_name, error, timestamp；
+            # 单行损坏（如写入中途被中断）只跳过该行，其余记录照常重试
+            try:
+                record = _json_loads(line)
+                failed_stocks.append(
+                    {
+                        "converted_code": record["stock_code"],
+                        "stock_name": record["stock_name"],
+                    }
+                )
+            except Exception as e:
+                logger.warning(f"跳过失败日志第 {line_no} 行（无法解析）: {e}")
+
+        if failed_stocks:
+            logger.info(f"从日志文件读取到 {len(failed_stocks)} 只失败股票")
+            return failed_stocks
 
     # 如果没有找到失败记录，返回空列表
     return []
 
 
+def _json_dumps_line(record):
+    """将一条记录序列化为一行 JSON（bytes，以换行结尾）"""
+    if orjson is not None:
+        return orjson.dumps(record) + b"\n"
+    return json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def _json_loads(line):
+    """解析一行 JSON"""
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
 def analyze_factor_summary(df):
     """
     智能分析 DataFrame 的因子分类
@@ -143,60 +303,30 @@ def analyze_factor_summary(df):
     if not isinstance(df, pd.DataFrame):
         raise TypeError(f"参数必须是 pandas DataFrame，而不是 {type(df).__name__}")
     
-    columns = df.columns.tolist()
-    
-    # 定义分类规则（基于列名模式）
-    categories = {}
-    
-    # 1. 基础信息
-    basic_info = []
-    for col in ["交易日期", "股票代码", "股票简称"]:
-        if col in columns:
-            basic_info.append(col)
-    if basic_info:
-        categories["基础信息"] = basic_info
-    
-    # 2. 后复权技术因子
-    adjusted_tech = [col for col in columns if col.endswith("_后复权")]
-    if adjusted_tech:
-        categories["后复权技术因子"] = adjusted_tech
-    
-    # 3. 衍生技术因子
-    derived_tech = []
-    derived_keywords = ["涨跌", "振幅", "成交额", "换手率", "流通股"]
-    for col in columns:
-        if any(keyword in col for keyword in derived_keywords):
-            if col not in adjusted_tech:  # 避免重复
-                derived_tech.append(col)
-    if derived_tech:
-        categories["衍生技术因子"] = derived_tech
-    
-    # 4. 未复权技术因子
-    unadjusted_tech = [col for col in columns if col.endswith("_未复权")]
-    if unadjusted_tech:
-        categories["未复权技术因子"] = unadjusted_tech
-    
-    # 5. 资金流因子
-    flow_factors = [col for col in columns if "主买" in col or "主卖" in col]
-    if flow_factors:
-        categories["资金流因子"] = flow_factors
-    
-    # 6. 基本面因子
-    fundamental = []
-    fundamental_keywords = [
-        "市盈率", "市净率", "市销率", "股息率", "市值", "账面市值比",
-        "息税前利润", "息税折旧摊销前利润", "每股息税前利润", "净资产收益率"
+    # 列名匹配在 pandas 的向量化字符串操作中完成
+    columns = pd.Index(df.columns)
+    adjusted_mask = columns.str.endswith("_后复权")
+    
+    # 按顺序定义分类规则（基于列名模式）
+    rules = [
+        ("基础信息", columns.isin(BASIC_INFO_COLUMNS)),
+        ("后复权技术因子", adjusted_mask),
+        # 衍生技术因子（排除已归入后复权技术因子的列，避免重复）
+        (
+            "衍生技术因子",
+            columns.str.contains(DERIVED_FACTOR_PATTERN) & ~adjusted_mask,
+        ),
+        ("未复权技术因子", columns.str.endswith("_未复权")),
+        ("资金流因子", columns.str.contains(FLOW_FACTOR_PATTERN)),
+        ("基本面因子", columns.str.contains(FUNDAMENTAL_FACTOR_PATTERN)),
+        ("股东户数因子", columns.str.contains(SHAREHOLDER_FACTOR_PATTERN)),
     ]
-    for col in columns:
-        if any(keyword in col for keyword in fundamental_keywords):
-            fundamental.append(col)
-    if fundamental:
-        categories["基本面因子"] = fundamental
     
-    # 7. 股东户数因子
-    shareholder = [col for col in columns if "股东" in col or "户均" in col]
-    if shareholder:
-        categories["股东户数因子"] = shareholder
+    categories = {}
+    for category, mask in rules:
+        matched = columns[mask].tolist()
+        if matched:
+            categories[category] = matched
     
     return categories
 
@@ -211,12 +341,21 @@ def print_factor_summary_once(df):
     Args:
         df: 因子数据 DataFrame
     """
-    global _factor_summary_printed
-    
     # 如果已经打印过，直接返回
-    if _factor_summary_printed:
+    if _factor_summary_printed.is_set():
         return
     
+    with _factor_summary_lock:
+        # 加锁后再检查一次，防止多个线程同时打印
+        if _factor_summary_printed.is_set():
+            return
+        _print_factor_summary(df)
+        # 标记为已打印
+        _factor_summary_printed.set()
+
+
+def _print_factor_summary(df):
+    """打印因子分类统计表格"""
     # 自动分析因子分类
     categories = analyze_factor_summary(df)
     
@@ -248,9 +387,6 @@ def print_factor_summary_once(df):
     print(f"【总计】 {total_count}个因子")
     print("=" * 100)
     print()
-    
-    # 标记为已打印
-    _factor_summary_printed = True
 
 
 def reset_factor_summary_flag():
@@ -259,42 +395,60 @@ def reset_factor_summary_flag():
     
     用于在新的批处理任务中重新打印表格
     """
-    global _factor_summary_printed
-    _factor_summary_printed = False
+    _factor_summary_printed.clear()
+
+
+def exception_error(e):
+    """
+    将异常记录为结构化的 (异常类型名, 异常信息) 元组
+
+    失败信息为元组表示意外异常（网络错误、限流等），重试模式会对其退避重试；
+    已知的数据缺失类失败用字符串表示。
+
+    一般异常只取 e.args[0]，不调用异常的 __str__（pandas 等异常的 __str__ 可能很重），
+    格式化推迟到最终写失败日志时（format_error）。
+    OSError 的 args[0] 只是错误码，改取错误说明和文件路径（写盘失败时需要知道是哪个文件）。
+    """
+    if isinstance(e, OSError) and e.strerror:
+        message = f"{e.strerror}: {e.filename}" if e.filename else e.strerror
+        return (type(e).__name__, message)
+    return (type(e).__name__, str(e.args[0]) if e.args else "")
+
+
+def format_error(error):
+    """
+    将错误信息格式化为字符串
 
+    Args:
+        error: 错误信息字符串，或结构化的 (异常类型名, 异常信息) 元组
 
+    Returns:
+        str: 错误信息
+    """
+    if isinstance(error, tuple):
+        error_type, error_message = error
+        return f"{error_type}: {error_message}"
+    return str(error)
+
+
+@functools.lru_cache(maxsize=4096)
 def categorize_error(error_message):
     """
     根据错误信息对错误进行分类
+
+    同一接口的错误信息大量重复，结果按错误信息缓存。
     
     Args:
-        error_message: 错误信息字符串
+        error_message: 错误信息字符串或 (异常类型名, 异常信息) 元组
     
     Returns:
         str: 错误类型
     """
-    error_str = str(error_message)
-    
-    if "instruments()" in error_str and "未能找到股票" in error_str:
-        return "米筐API的 `instruments()` 函数未能找到股票的基本信息"
-    elif "get_capital_flow()" in error_str:
-        return "米筐API的 get_capital_flow() 返回 None"
-    elif "get_price()" in error_str and "后复权" in error_str:
-        return "米筐API的 get_price() 返回空数据(后复权)"
-    elif "get_price()" in error_str and "未复权" in error_str:
-        return "米筐API的 get_price() 返回空数据(未复权)"
-    elif "get_turnover_rate()" in error_str:
-        return "米筐API的 get_turnover_rate() 返回 None"
-    elif "get_shares()" in error_str:
-        return "米筐API的 get_shares() 返回 None"
-    elif "get_vwap()" in error_str:
-        return "米筐API的 get_vwap() 返回 None"
-    elif "get_factor()" in error_str:
-        return "米筐API的 get_factor() 返回空数据"
-    elif "get_holder_number()" in error_str:
-        return "米筐API的 get_holder_number() 返回空数据"
-    else:
-        return "其他错误"
+    error_str = format_error(error_message)
+    for pattern, error_type in ERROR_CATEGORY_RULES:
+        if pattern.search(error_str):
+            return error_type
+    return "其他错误"
 
 
 def get_exchange(stock_code):
@@ -307,14 +461,25 @@ def get_exchange(stock_code):
     Returns:
         str: 交易所名称
     """
-    if stock_code.endswith('.XSHG'):
-        return '上交所'
-    elif stock_code.endswith('.XSHE'):
-        return '深交所'
-    elif stock_code.endswith('.BJSE'):
-        return '北交所'
-    else:
-        return '未知'
+    return EXCHANGE_NAME_MAP.get(stock_code[-5:], '未知')
+
+
+def get_exchanges(stock_codes):
+    """
+    批量判断交易所（get_exchange 的向量化版本）
+    
+    Args:
+        stock_codes: 股票代码 Series
+    
+    Returns:
+        np.ndarray: 交易所名称数组
+    """
+    suffix = stock_codes.str[-5:]
+    return np.select(
+        [suffix == s for s in EXCHANGE_NAME_MAP],
+        list(EXCHANGE_NAME_MAP.values()),
+        default='未知',
+    )
 
 
 def analyze_failures(failed_stocks_list, total_stocks=None):
@@ -328,22 +493,16 @@ def analyze_failures(failed_stocks_list, total_stocks=None):
     Returns:
         str: 格式化的汇总报告文本
     """
-    from collections import defaultdict
-    
     if not failed_stocks_list:
         return "没有失败的股票"
     
-    # 按错误类型分类
-    error_categories = defaultdict(list)
-    for stock in failed_stocks_list:
-        error_type = categorize_error(stock['error'])
-        error_categories[error_type].append(stock)
-    
-    # 按交易所分类
-    exchange_stocks = defaultdict(list)
-    for stock in failed_stocks_list:
-        exchange = get_exchange(stock['stock_code'])
-        exchange_stocks[exchange].append(stock)
+    # 一次性打上错误类型和交易所标签，再交叉统计
+    failures = pd.DataFrame(
+        failed_stocks_list, columns=["stock_code", "stock_name", "error"]
+    )
+    failures["error_type"] = failures["error"].map(categorize_error)
+    failures["exchange"] = get_exchanges(failures["stock_code"])
+    counts = pd.crosstab(failures["error_type"], failures["exchange"])
     
     # 生成报告
     lines = []
@@ -370,21 +529,20 @@ def analyze_failures(failed_stocks_list, total_stocks=None):
     lines.append("【按错误类型分类】")
     lines.append("-" * 100)
     
-    for error_type in sorted(error_categories.keys()):
-        stocks = error_categories[error_type]
+    for error_type, stocks in failures.groupby("error_type", sort=True):
         lines.append(f"\n{error_type}: {len(stocks)} 只")
         
         # 统计交易所分布
-        exchange_count = defaultdict(int)
-        for stock in stocks:
-            exchange = get_exchange(stock['stock_code'])
-            exchange_count[exchange] += 1
-        
-        exchange_summary = ', '.join([f"{ex}: {cnt}只" for ex, cnt in sorted(exchange_count.items())])
+        exchange_count = counts.loc[error_type]
+        exchange_summary = ', '.join(
+            [f"{ex}: {cnt}只" for ex, cnt in exchange_count[exchange_count > 0].items()]
+        )
         lines.append(f"  交易所分布: {exchange_summary}")
         
         # 列出前5只股票
-        examples = ', '.join([f"{s['stock_code']}({s['stock_name']})" for s in stocks[:5]])
+        examples = ', '.join(
+            [f"{code}({name})" for code, name in zip(stocks["stock_code"][:5], stocks["stock_name"][:5])]
+        )
         lines.append(f"  示例: {examples}")
         if len(stocks) > 5:
             lines.append(f"  ... 还有 {len(stocks) - 5} 只")
@@ -396,17 +554,13 @@ def analyze_failures(failed_stocks_list, total_stocks=None):
     lines.append("-" * 100)
     
     for exchange in ['上交所', '深交所', '北交所', '未知']:
-        if exchange in exchange_stocks:
-            stocks = exchange_stocks[exchange]
+        if exchange in counts.columns:
+            stocks = failures[failures["exchange"] == exchange]
             lines.append(f"\n{exchange}: {len(stocks)} 只")
             
-            # 统计错误类型分布
-            error_dist = defaultdict(int)
-            for stock in stocks:
-                error_type = categorize_error(stock['error'])
-                error_dist[error_type] += 1
-            
-            for error_type, count in sorted(error_dist.items(), key=lambda x: -x[1]):
+            # 统计错误类型分布（数量相同时按首次出现顺序）
+            error_dist = counts[exchange].reindex(stocks["error_type"].unique())
+            for error_type, count in error_dist.sort_values(ascending=False, kind="stable").items():
                 lines.append(f"  - {error_type}: {count}只")
     
     lines.append("")
@@ -417,7 +571,10 @@ def analyze_failures(failed_stocks_list, total_stocks=None):
 
 def write_failure_logs(failed_stocks_list, log_dir, total_stocks=None):
     """
-    写入失败汇总报告
+    写入失败股票列表和失败汇总报告
+    
+    失败股票列表（供 retry 模式读取）为 JSON Lines，每行一条记录，
+    字段: stock_code, stock_name, error, timestamp；在内存中拼好后一次性写入
     
     Args:
         failed_stocks_list: 失败股票列表
@@ -429,7 +586,25 @@ def write_failure_logs(failed_stocks_list, log_dir, total_stocks=None):
     """
     os.makedirs(log_dir, exist_ok=True)
     
-    today = datetime.now().strftime("%Y%m%d")
+    now = datetime.now()
+    today = now.strftime("%Y%m%d")
+    timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+    
+    # 一次性写入失败股票列表
+    lines = [
+        _json_dumps_line(
+            {
+                "stock_code": stock["stock_code"],
+                "stock_name": stock["stock_name"],
+                "error": format_error(stock["error"]),
+                "timestamp": timestamp,
+            }
+        )
+        for stock in failed_stocks_list
+    ]
+    failed_file = os.path.join(log_dir, f"failed_stocks_{today}.jsonl")
+    with open(failed_file, "wb", buffering=1024 * 1024) as f:
+        f.writelines(lines)
     
     # 生成并写入汇总报告
     summary_report = analyze_failures(failed_stocks_list, total_stocks)
@@ -7,6 +7,7 @@ import sys
 import os
 from datetime import datetime
 from loguru import logger
+import numpy as np
 import pandas as pd
 
 pd.set_option("display.max_columns", 10)
@@ -14,17 +15,40 @@ pd.set_option("display.width", 200)
 
 
 # 导入米筐API
-from rq_api import *
+from rq_api import (
+    get_instrument,
+    get_instruments,
+    get_price,
+    get_turnover_rate,
+    get_shares,
+    get_vwap,
+    get_capital_flow,
+    get_factor,
+    get_holder_number,
+)
 from config import get_config
-from data_utils import print_factor_summary_once
+from data_utils import exception_error, format_error, print_factor_summary_once
+
+# 因子配置在导入时读取一次（配置为只读单例，运行期间不会变化）
+_CONFIG = get_config()
+FUNDAMENTAL_FACTORS = list(_CONFIG["fundamental_factors"])  # 基本面因子
+TECHNICAL_FACTORS = list(_CONFIG["technical_factors"])  # 技术因子（get_price 字段）
+FLOW_FACTORS = list(_CONFIG["flow_factors"])  # 资金流因子
+FACTOR_NAME_MAPPING = dict(_CONFIG["factor_name_mapping"])  # 英文列名 -> 中文列名
+COLUMN_ORDER = list(_CONFIG["column_order"])  # 输出列顺序
+OUTPUT_COLUMNS = [
+    FACTOR_NAME_MAPPING.get(col, col) for col in COLUMN_ORDER
+]  # 按输出列顺序排列的中文列名
+DECIMAL_PLACES = 4  # 因子保留的小数位数
 
 
 def _merge_daily_and_quarterly_factors(daily_factors, quarterly_factors):
     """
     合并日度因子和季度因子数据
 
-    对于季度数据，使用 merge_asof 进行向前填充，确保每个交易日都能获取到
-    最新的（但不是未来的）季度数据。
+    对于季度数据进行向前填充，确保每个交易日都能获取到最新的（但不是未来的）
+    季度数据。两边都只有一只股票，直接用 searchsorted 在季度日期上定位，
+    不必走 merge_asof 的分组合并。
 
     Args:
         daily_factors: 日度因子DataFrame，索引为 (order_book_id, date)
@@ -33,47 +57,161 @@ def _merge_daily_and_quarterly_factors(daily_factors, quarterly_factors):
     Returns:
         pd.DataFrame: 合并后的DataFrame，索引为 (order_book_id, date)
     """
-    # 重置索引，将索引转换为列
-    daily_reset = daily_factors.reset_index()
-    quarterly_reset = quarterly_factors.reset_index()
-
-    # 确保日期列是datetime类型并排序
-    daily_reset["date"] = pd.to_datetime(daily_reset["date"])
-    quarterly_reset["date"] = pd.to_datetime(quarterly_reset["date"])
-    daily_reset = daily_reset.sort_values("date")
-    quarterly_reset = quarterly_reset.sort_values("date")
-
-    # 使用 merge_asof 进行向前填充合并
-    # direction='backward' 表示：对于每个交易日，使用最近的、不晚于该日期的季度数据
-    merged = pd.merge_asof(
-        daily_reset,
-        quarterly_reset,
-        on="date",
-        by="order_book_id",
-        direction="backward",
+    daily_dates = pd.to_datetime(daily_factors.index.get_level_values("date"))
+    if not daily_dates.is_monotonic_increasing:
+        order = np.argsort(daily_dates.to_numpy(), kind="stable")
+        daily_factors = daily_factors.iloc[order]
+        daily_dates = daily_dates[order]
+
+    quarterly_dates = pd.to_datetime(quarterly_factors.index.get_level_values("date"))
+    if not quarterly_dates.is_monotonic_increasing:
+        order = np.argsort(quarterly_dates.to_numpy(), kind="stable")
+        quarterly_factors = quarterly_factors.iloc[order]
+        quarterly_dates = quarterly_dates[order]
+
+    # 对于每个交易日，找最近的、不晚于该日期的季度数据所在行（没有时为 -1）
+    positions = (
+        np.searchsorted(quarterly_dates.to_numpy(), daily_dates.to_numpy(), side="right")
+        - 1
     )
 
-    # 恢复索引
-    merged = merged.set_index(["order_book_id", "date"]).drop(columns="end_date")
+    merged = daily_factors.set_axis(
+        pd.MultiIndex.from_arrays(
+            [daily_factors.index.get_level_values("order_book_id"), daily_dates],
+            names=["order_book_id", "date"],
+        )
+    )
+    # -1 位置填充缺失值（整数列只在确有缺失时才转为浮点，与 merge_asof 一致）
+    for col in quarterly_factors.columns.drop("end_date"):
+        merged[col] = pd.api.extensions.take(
+            quarterly_factors[col].to_numpy(), positions, allow_fill=True
+        )
     return merged
 
 
-def generate_factors_for_stock(stock_symbol, dataset_end_date):
+def _prefetched_or_call(prefetched, key, fetch):
+    """有批量预取的数据时直接使用，否则调用米筐API"""
+    if prefetched is None:
+        return fetch()
+    return prefetched[key]
+
+
+def _fetch_batch_panels(stock_symbols, dataset_end_date):
     """
-    为单只股票生成所有因子数据
+    对一批股票，每个米筐接口只调用一次，取回整批股票的数据
+
+    起始日期取这批股票中最早的上市日期，各接口返回的多股票数据
+    按股票代码预先分组，供 _slice_prefetched 按股票切片。
+
+    Returns:
+        dict: {"instruments": {代码: Instrument}, 接口名: {代码: 该股票的数据}}
+    """
+    unadjusted_fields = [f for f in TECHNICAL_FACTORS if f != "total_turnover"]
+
+    instrument_map = get_instruments(stock_symbols, dataset_end_date)
+    panels = {"instruments": instrument_map}
+    if not instrument_map:
+        return panels
+
+    symbols = list(instrument_map)
+    start_date = min(ins.listed_date for ins in instrument_map.values())
+    end_date = dataset_end_date
+
+    raw_panels = {
+        "price_adjusted": get_price(
+            symbols,
+            start_date,
+            end_date,
+            fields=TECHNICAL_FACTORS,
+            adjust_type="post_volume",
+            skip_suspended=False,
+        ),
+        "turnover": get_turnover_rate(symbols, start_date, end_date),
+        "price_unadjusted": get_price(
+            symbols,
+            start_date,
+            end_date,
+            fields=unadjusted_fields,
+            adjust_type="none",
+            skip_suspended=False,
+        ),
+        "shares": get_shares(symbols, start_date, end_date),
+        "vwap": get_vwap(symbols, start_date, end_date),
+        "capital_flow": get_capital_flow(symbols, start_date, end_date),
+        "fundamental": get_factor(
+            symbols, FUNDAMENTAL_FACTORS, start_date, end_date
+        ),
+        "holder_number": get_holder_number(symbols, start_date, end_date),
+    }
+    for key, panel in raw_panels.items():
+        if panel is None:
+            panels[key] = {}
+        else:
+            panels[key] = dict(tuple(panel.groupby(level=0, sort=False)))
+    return panels
+
+
+def _slice_prefetched(panels, stock_symbol):
+    """
+    从批量数据中切出单只股票的数据，格式与单只调用米筐API的返回值一致
+
+    批量请求的起始日期是整批最早的上市日期，日度数据按该股票的上市日期截掉之前的行
+    （股东户数按报告期索引、上市前本就没有记录，不截取）；没有数据的接口返回 None。
+    """
+    instrument = panels["instruments"].get(stock_symbol)
+    prefetched = {"instrument": instrument}
+    if instrument is None:
+        return prefetched
+
+    listed_date = pd.Timestamp(instrument.listed_date)
+    for key, groups in panels.items():
+        if key == "instruments":
+            continue
+        data = groups.get(stock_symbol)
+        if data is not None and key != "holder_number":
+            data = data[data.index.get_level_values(1) >= listed_date]
+        prefetched[key] = data if data is not None and len(data) else None
+    return prefetched
+
+
+def generate_factors_for_batch(stock_symbols, dataset_end_date):
+    """
+    批量生成多只股票的因子数据
+
+    每个米筐接口对整批股票只请求一次（而不是每只股票各请求一遍），
+    再按股票切片后逐只计算因子；批量取数失败时退回逐只调用 generate_factors_for_stock。
+
+    Returns:
+        dict: {stock_symbol: (factors_df, error_message)}
     """
     try:
-        # 获取配置信息
-        config = get_config()
-        fundamental_factors = config["fundamental_factors"]
-        technical_factors = config["technical_factors"]
-        flow_factors = config["flow_factors"]
-        factor_name_mapping = config["factor_name_mapping"]
-        column_order = config["column_order"]
-        decimal_places = 4
+        panels = _fetch_batch_panels(stock_symbols, dataset_end_date)
+    except Exception as e:
+        logger.warning(f"批量取数失败，退回逐只处理 {len(stock_symbols)} 只股票: {e}")
+        return {
+            symbol: generate_factors_for_stock(symbol, dataset_end_date)
+            for symbol in stock_symbols
+        }
+
+    return {
+        symbol: generate_factors_for_stock(
+            symbol, dataset_end_date, prefetched=_slice_prefetched(panels, symbol)
+        )
+        for symbol in stock_symbols
+    }
+
+
+def generate_factors_for_stock(stock_symbol, dataset_end_date, prefetched=None):
+    """
+    为单只股票生成所有因子数据
 
+    prefetched: generate_factors_for_batch 预取并切好的该股票数据，为 None 时直接调用米筐API
+    """
+    try:
         # 获取股票基本信息
-        stock_instrument = instruments(stock_symbol)
+        stock_instrument = _prefetched_or_call(
+            prefetched, "instrument", lambda: get_instrument(stock_symbol)
+        )
         if stock_instrument is None:
             error_msg = (
                 f"米筐API的 `instruments()` 函数未能找到股票 {stock_symbol} 的基本信息"
@@ -85,22 +223,38 @@ def generate_factors_for_stock(stock_symbol, dataset_end_date):
 
         # 获取所有后复权技术因子数据
         daily_tech_adjusted = get_technical_factor_adjusted(
-            stock_symbol, technical_factors, stock_listed_date, dataset_end_date
+            stock_symbol,
+            TECHNICAL_FACTORS,
+            stock_listed_date,
+            dataset_end_date,
+            prefetched=prefetched,
         )
 
         # 获取所有未复权技术因子数据
         daily_tech_unadjusted = get_technical_factor_unadjusted(
-            stock_symbol, technical_factors, stock_listed_date, dataset_end_date
+            stock_symbol,
+            TECHNICAL_FACTORS,
+            stock_listed_date,
+            dataset_end_date,
+            prefetched=prefetched,
         )
 
         # 获取所有资金流因子数据
         daily_flow = get_flow_factor(
-            stock_symbol, flow_factors, stock_listed_date, dataset_end_date
+            stock_symbol,
+            FLOW_FACTORS,
+            stock_listed_date,
+            dataset_end_date,
+            prefetched=prefetched,
         )
 
         # 获取基本面因子（使用配置文件中的因子列表），get_factor是米筐的函数
-        daily_fundamental = get_factor(
-            stock_symbol, fundamental_factors, stock_listed_date, dataset_end_date
+        daily_fundamental = _prefetched_or_call(
+            prefetched,
+            "fundamental",
+            lambda: get_factor(
+                stock_symbol, FUNDAMENTAL_FACTORS, stock_listed_date, dataset_end_date
+            ),
         )
         if daily_fundamental is None or daily_fundamental.empty:
             raise ValueError(
@@ -111,7 +265,7 @@ def generate_factors_for_stock(stock_symbol, dataset_end_date):
 
         # 获取股东户数因子（季度数据）
         daily_shareholder = get_shareholder_factor(
-            stock_symbol, stock_listed_date, dataset_end_date
+            stock_symbol, stock_listed_date, dataset_end_date, prefetched=prefetched
         )
 
         # 将日度因子DataFrame放入列表（不包括季度数据）
@@ -137,23 +291,29 @@ def generate_factors_for_stock(stock_symbol, dataset_end_date):
         # 首先重置索引为列
         daily_factors = daily_factors.reset_index()
 
-        # 使用配置文件中的列顺序
-        daily_factors = daily_factors[column_order]
-
-        # 将列名从英文转换为中文
-        daily_factors = daily_factors.rename(columns=factor_name_mapping)
-
-        # 保留指定位数的小数
-        daily_factors = daily_factors.round(decimal_places)
+        # 使用配置文件中的列顺序，并一步换成中文列名
+        daily_factors = daily_factors[COLUMN_ORDER].set_axis(OUTPUT_COLUMNS, axis=1)
 
         # 将交易日期格式改为YYYYMMDD格式（不带斜杠）
-        daily_factors["交易日期"] = daily_factors["交易日期"].dt.strftime("%Y%m%d")
+        # 用年月日整数拼出 YYYYMMDD 再整列转字符串，避免逐个元素 strftime；
+        # 转为可空整数 Int64，有 NaT 时其余行不会变成 "20250818.0"，NaT 行与 strftime 一样为缺失值
+        trade_dates = daily_factors["交易日期"].dt
+        date_ints = (
+            trade_dates.year * 10000 + trade_dates.month * 100 + trade_dates.day
+        ).astype("Int64")
+        daily_factors["交易日期"] = date_ints.astype(str).where(date_ints.notna())
+
+        # 保留指定位数的小数（日期已转为字符串，round 只作用于数值列）
+        daily_factors = daily_factors.round(DECIMAL_PLACES)
 
         # 删除第一行数据（因为prev_close计算导致第一行为NaN）
         # daily_factors = daily_factors.iloc[1:]
 
         # 过滤掉停牌的股票
-        daily_factors_filtered = daily_factors[daily_factors["换手率(%)"] > 0]
+        # 算出保留行的位置后按位置切片，避免布尔 Series 的索引对齐；
+        # 用 Series.gt 比较，换手率为 object 列且含 None 时缺失行视为停牌，不会报错
+        trading_rows = np.flatnonzero(daily_factors["换手率(%)"].gt(0).to_numpy())
+        daily_factors_filtered = daily_factors.iloc[trading_rows]
 
         # 打印因子统计表格（只在第一次调用时打印，传入实际的 DataFrame）
         print_factor_summary_once(daily_factors_filtered)
@@ -162,26 +322,31 @@ def generate_factors_for_stock(stock_symbol, dataset_end_date):
         return daily_factors_filtered, None
 
     except Exception as e:
-        error_msg = f"{type(e).__name__} - {str(e)}".replace("\n", " ")
-        logger.error(f"处理股票 {stock_symbol} 时出错: {error_msg}")
-        return None, error_msg
+        # 米筐请求异常（网络错误、限流等）记为结构化元组，重试模式据此退避重试
+        error = exception_error(e)
+        logger.error(f"处理股票 {stock_symbol} 时出错: {format_error(error)}")
+        return None, error
 
 
 def get_technical_factor_adjusted(
-    stock_symbol, technical_factors, start_date, end_date
+    stock_symbol, technical_factors, start_date, end_date, prefetched=None
 ):
     """
     获取股票的所有原始数据
     """
     # 后复权技术因子数据,获取open,high,low,close,volume,total_turnover
     # adjust_type="post_volume"这里的成交量是后复权因子调整后的成交量
-    daily_tech = get_price(
-        stock_symbol,
-        start_date,
-        end_date,
-        fields=technical_factors,
-        adjust_type="post_volume",
-        skip_suspended=False,
+    daily_tech = _prefetched_or_call(
+        prefetched,
+        "price_adjusted",
+        lambda: get_price(
+            stock_symbol,
+            start_date,
+            end_date,
+            fields=technical_factors,
+            adjust_type="post_volume",
+            skip_suspended=False,
+        ),
     )
 
     # 检查 API 返回结果
@@ -194,27 +359,32 @@ def get_technical_factor_adjusted(
 
     daily_tech = daily_tech.sort_index()
 
-    # 计算前一日收盘价
-    daily_tech["prev_close"] = daily_tech["close"].shift(1)
-
-    # 计算涨跌额
-    daily_tech["change_amount"] = daily_tech["close"] - daily_tech["prev_close"]
-
-    # 计算涨跌幅
-    daily_tech["change_pct"] = (
-        daily_tech["close"] - daily_tech["prev_close"]
-    ) / daily_tech["prev_close"]
-
-    # 计算振幅
-    daily_tech["amplitude"] = (daily_tech["high"] - daily_tech["low"]) / daily_tech[
-        "prev_close"
-    ]
-
-    # 计算vwap
-    daily_tech["vwap_adjusted"] = daily_tech["total_turnover"] / daily_tech["volume"]
+    # 在底层数组上一次算出衍生列，避免逐列生成中间 Series 和索引对齐
+    close = daily_tech["close"].to_numpy(dtype=float)
+    high = daily_tech["high"].to_numpy(dtype=float)
+    low = daily_tech["low"].to_numpy(dtype=float)
+    total_turnover = daily_tech["total_turnover"].to_numpy(dtype=float)
+    volume = daily_tech["volume"].to_numpy(dtype=float)
+
+    # 前一日收盘价
+    prev_close = np.empty_like(close)
+    prev_close[:1] = np.nan
+    prev_close[1:] = close[:-1]
+    change_amount = close - prev_close
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        daily_tech["prev_close"] = prev_close
+        daily_tech["change_amount"] = change_amount  # 涨跌额
+        daily_tech["change_pct"] = change_amount / prev_close  # 涨跌幅
+        daily_tech["amplitude"] = (high - low) / prev_close  # 振幅
+        daily_tech["vwap_adjusted"] = total_turnover / volume  # vwap
 
     # 换手率数据
-    turnover_data = get_turnover_rate(stock_symbol, start_date, end_date)
+    turnover_data = _prefetched_or_call(
+        prefetched,
+        "turnover",
+        lambda: get_turnover_rate(stock_symbol, start_date, end_date),
+    )
     if turnover_data is None:
         raise ValueError(
             f"米筐API的 get_turnover_rate() 返回 None。"
@@ -240,7 +410,7 @@ def get_technical_factor_adjusted(
 
 
 def get_technical_factor_unadjusted(
-    stock_symbol, technical_factors, start_date, end_date
+    stock_symbol, technical_factors, start_date, end_date, prefetched=None
 ):
     """
     获取股票的未复权技术因子
@@ -250,6 +420,7 @@ def get_technical_factor_unadjusted(
         technical_factors: 技术因子列表
         start_date: 开始日期
         end_date: 结束日期
+        prefetched: 批量预取的该股票数据（可选）
 
     Returns:
         pd.DataFrame: 未复权技术因子数据
@@ -258,13 +429,17 @@ def get_technical_factor_unadjusted(
     technical_factors_copy = [f for f in technical_factors if f != "total_turnover"]
 
     # 未复权技术因子数据,获取open,high,low,close,volume
-    daily_tech = get_price(
-        stock_symbol,
-        start_date,
-        end_date,
-        fields=technical_factors_copy,
-        adjust_type="none",
-        skip_suspended=False,
+    daily_tech = _prefetched_or_call(
+        prefetched,
+        "price_unadjusted",
+        lambda: get_price(
+            stock_symbol,
+            start_date,
+            end_date,
+            fields=technical_factors_copy,
+            adjust_type="none",
+            skip_suspended=False,
+        ),
     )
 
     # 检查 API 返回结果
@@ -278,29 +453,38 @@ def get_technical_factor_unadjusted(
     daily_tech = daily_tech.sort_index()
 
     # 自由流通股本
-    vol_start_date = daily_tech["volume"].index.get_level_values("date").min()
-    shares_data = get_shares(stock_symbol, vol_start_date, end_date)
+    # 已按索引排序（单只股票即按日期升序），第一行就是最早的交易日
+    vol_start_date = daily_tech.index[0][daily_tech.index.names.index("date")]
+    shares_data = _prefetched_or_call(
+        prefetched,
+        "shares",
+        lambda: get_shares(stock_symbol, vol_start_date, end_date),
+    )
     if shares_data is None:
         raise ValueError(
             f"米筐API的 get_shares() 返回 None。"
             f"股票: {stock_symbol}, 日期范围: {vol_start_date} 至 {end_date}。"
             f"可能原因: 该股票没有股本数据。"
         )
-    daily_tech["stock_free_circulation"] = shares_data.free_circulation
-
-    # 计算自由流通股本换手率
-    daily_tech["free_turnover"] = (
-        daily_tech["volume"] / daily_tech["stock_free_circulation"]
-    ) * 100
 
     # 计算vwap
-    vwap_data = get_vwap(stock_symbol, start_date, end_date)
+    vwap_data = _prefetched_or_call(
+        prefetched, "vwap", lambda: get_vwap(stock_symbol, start_date, end_date)
+    )
     if vwap_data is None:
         raise ValueError(
             f"米筐API的 get_vwap() 返回 None。"
             f"股票: {stock_symbol}, 日期范围: {start_date} 至 {end_date}。"
             f"可能原因: 该股票没有VWAP数据。"
         )
+
+    # 股本按交易日对齐一次，自由流通股本换手率直接在底层数组上计算
+    free_circulation = shares_data.free_circulation.reindex(daily_tech.index).to_numpy()
+    volume = daily_tech["volume"].to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        free_turnover = volume / free_circulation.astype(float) * 100
+    daily_tech["stock_free_circulation"] = free_circulation
+    daily_tech["free_turnover"] = free_turnover
     daily_tech["vwap_unadjusted"] = vwap_data
 
     # 1. 定义旧名称到新名称的映射
@@ -318,11 +502,15 @@ def get_technical_factor_unadjusted(
     return daily_tech
 
 
-def get_flow_factor(stock_symbol, flow_factors, start_date, end_date):
+def get_flow_factor(stock_symbol, flow_factors, start_date, end_date, prefetched=None):
     """
     获取股票的资金流入和流出
     """
-    capital_flow = get_capital_flow(stock_symbol, start_date, end_date)
+    capital_flow = _prefetched_or_call(
+        prefetched,
+        "capital_flow",
+        lambda: get_capital_flow(stock_symbol, start_date, end_date),
+    )
 
     # 检查 API 返回结果
     if capital_flow is None:
@@ -335,7 +523,7 @@ def get_flow_factor(stock_symbol, flow_factors, start_date, end_date):
     capital_flow = capital_flow.loc[:, flow_factors]
     return capital_flow
 
-def get_shareholder_factor(stock_symbol, start_date, end_date):
+def get_shareholder_factor(stock_symbol, start_date, end_date, prefetched=None):
     """
     获取股票的股东户数因子
 
@@ -344,7 +532,11 @@ def get_shareholder_factor(stock_symbol, start_date, end_date):
     - 我们使用 info_date（发布日期）作为时间索引，因为这是数据真正可用的时间点
     - 如果同一天发布了多个报告期的数据，我们保留 end_date 最大的那条（最新报告期）
     """
-    shareholder_factor = get_holder_number(stock_symbol, start_date, end_date)
+    shareholder_factor = _prefetched_or_call(
+        prefetched,
+        "holder_number",
+        lambda: get_holder_number(stock_symbol, start_date, end_date),
+    )
 
     # 检查 API 返回结果
     if shareholder_factor is None or shareholder_factor.empty:
@@ -357,18 +549,18 @@ def get_shareholder_factor(stock_symbol, start_date, end_date):
     # 重置索引，将所有索引层级转换为列
     shareholder_factor = shareholder_factor.reset_index()
 
-    # 处理同一天发布多个报告期数据的情况
-    # 对于同一个 (order_book_id, info_date)，保留 end_date 最大的那条记录
-    shareholder_factor = shareholder_factor.sort_values("end_date", ascending=False)
-    shareholder_factor = shareholder_factor.drop_duplicates(
-        subset=["order_book_id", "info_date"], keep="first"
-    )
-
     # 使用 info_date（发布日期）作为时间索引，并重命名为 date
     shareholder_factor = shareholder_factor.rename(columns={"info_date": "date"})
 
-    # 按照 date 升序排序，这对于后续的 merge_asof 操作是必需的
-    shareholder_factor = shareholder_factor.sort_values(["order_book_id", "date"])
+    # 只排序一次：按 (order_book_id, date, end_date) 升序，
+    # 同一天发布多个报告期数据时保留 end_date 最大的那条（最新报告期），
+    # 结果同时满足后续向前填充合并对日期升序的要求
+    shareholder_factor = shareholder_factor.sort_values(
+        ["order_book_id", "date", "end_date"], kind="stable"
+    )
+    shareholder_factor = shareholder_factor.drop_duplicates(
+        subset=["order_book_id", "date"], keep="last"
+    )
 
     # 重新设置索引为 (order_book_id, date)
     shareholder_factor = shareholder_factor.set_index(["order_book_id", "date"])
@@ -54,6 +54,6 @@ if __name__ == "__main__":
         )
 
     elif test_mode == "retry_failed":
-        # 串行重试失败的股票
-        logger.success(f"串行重试处理失败的股票")
+        # 并行重试失败的股票
+        logger.success(f"并行重试处理失败的股票")
         retry_failed_stocks(save_dir, dataset_end_date)
@@ -6,11 +6,207 @@
 
 import sys
 import os
+import filecmp
+import hashlib
+import heapq
+import multiprocessing
+import re
 import pandas as pd
 import numpy as np
 from pathlib import Path
 import random
 from datetime import datetime
+from operator import itemgetter
+from tqdm import tqdm
+
+from config import CACHE_DIR
+from data_utils import atomic_write, load_pickle_cache, save_pickle_cache
+
+try:
+    import pyarrow as pa  # 可选依赖：多线程 C++ CSV 解析，比 pandas 快数倍
+    from pyarrow import csv as pacsv
+    from pyarrow import feather
+except ImportError:
+    pa = None
+
+try:
+    from numba import njit  # 可选依赖：把逐列差异计数编译成单次遍历的机器码
+except ImportError:
+    njit = None
+
+# 固定类型的列（其余数值列按文件推断，不同股票的整数/浮点列可能不同）
+CSV_COLUMN_TYPES = {
+    "交易日期": "int64",
+    "股票代码": "string",
+    "股票简称": "string",
+}
+
+FEATHER_SUFFIX = ".feather"  # convert_folder_to_feather 生成的列式缓存文件后缀
+COMPARE_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # 并行对比的进程数，留一个核给主进程
+COMPARE_CHUNKSIZE = 32  # 每次派给子进程的文件对数上限，摊薄进程间通信开销
+DIFF_RTOL = 1e-10  # 数值比较的相对容差
+DIFF_ATOL = 1e-10  # 数值比较的绝对容差
+COMPARE_CACHE_DIR = os.path.join(CACHE_DIR, "folder_comparison")  # 对比结果缓存目录
+COMPARE_CACHE_VERSION = 1  # 对比结果的结构或比较逻辑变化时加一，旧缓存自动失效
+# CSV 的 Feather 缓存目录：不写在CSV旁边，以免生产输出目录中的副本被当作 feather 格式的当日输出
+FEATHER_CACHE_DIR = os.path.join(COMPARE_CACHE_DIR, "feather")
+FOLDER_DATE_RE = re.compile(r"(\d{8})")  # 从文件夹名中提取8位日期
+
+
+def _read_csv_table(path):
+    """用 pyarrow 解析因子CSV，整列为空的列转为 float64，与 pandas 读出的 NaN 列保持一致"""
+    table = pacsv.read_csv(
+        path,
+        read_options=pacsv.ReadOptions(use_threads=True),
+        convert_options=pacsv.ConvertOptions(
+            column_types=CSV_COLUMN_TYPES, strings_can_be_null=True
+        ),
+    )
+    for i, field in enumerate(table.schema):
+        if pa.types.is_null(field.type):
+            table = table.set_column(
+                i, field.name, table.column(i).cast(pa.float64())
+            )
+    return table
+
+
+def _feather_cache_path(csv_path):
+    """CSV 对应的 Feather 缓存路径: FEATHER_CACHE_DIR/<所在目录绝对路径的md5>/<同名>.feather"""
+    folder, filename = os.path.split(os.path.abspath(csv_path))
+    folder_key = hashlib.md5(folder.encode("utf-8")).hexdigest()
+    return os.path.join(
+        FEATHER_CACHE_DIR, folder_key, os.path.splitext(filename)[0] + FEATHER_SUFFIX
+    )
+
+
+def _fresh_feather_path(csv_path):
+    """返回CSV对应且不早于CSV的 Feather 缓存路径，不存在或已过期时返回 None"""
+    feather_path = _feather_cache_path(csv_path)
+    try:
+        if os.path.getmtime(feather_path) >= os.path.getmtime(csv_path):
+            return feather_path
+    except OSError:
+        pass
+    return None
+
+
+def _write_feather(table, feather_path):
+    """把 Arrow 表写成未压缩 Feather 文件，先写临时文件再改名，中断时不会留下残缺文件"""
+    os.makedirs(os.path.dirname(feather_path), exist_ok=True)
+    with atomic_write(feather_path) as tmp_path:
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+
+
+def read_factor_csv(path, cache_feather=False):
+    """
+    读取因子CSV为 DataFrame，优先使用 pyarrow 解析，未安装时退回 pandas
+
+    FEATHER_CACHE_DIR 中有该CSV最新的 Feather 缓存时，直接内存映射读取；
+    cache_feather=True 时解析CSV后顺手写出 Feather 缓存，下次读取无需再解析
+    """
+    if pa is None:
+        # round_trip 与 pyarrow 一样精确解析浮点数，两条路径读出的数值完全一致
+        return pd.read_csv(path, encoding="utf-8", float_precision="round_trip")
+
+    feather_path = _fresh_feather_path(path)
+    if feather_path is not None:
+        return feather.read_table(feather_path, memory_map=True).to_pandas()
+
+    table = _read_csv_table(path)
+    if cache_feather:
+        try:
+            _write_feather(table, _feather_cache_path(path))
+        except OSError:
+            pass  # 缓存目录不可写时只是不缓存，不影响本次读取
+    return table.to_pandas()
+
+
+def convert_folder_to_feather(folder):
+    """
+    把文件夹中的因子CSV逐个转换为未压缩 Feather 文件，供反复对比时内存映射读取
+
+    转换结果写在 FEATHER_CACHE_DIR 中，不改动CSV所在的文件夹；
+    已有且不早于CSV的缓存和无法解析的CSV会跳过
+
+    Returns:
+        int: 本次新转换的文件数
+    """
+    if pa is None:
+        raise ImportError("转换 Feather 需要安装 pyarrow")
+
+    converted = 0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".csv") or not entry.is_file():
+                continue
+            if _fresh_feather_path(entry.path) is not None:
+                continue
+            try:
+                table = _read_csv_table(entry.path)
+            except Exception as e:
+                # 解析失败的文件保持CSV，对比时照常报告为错误
+                print(f"跳过无法解析的文件: {entry.name} ({e})")
+                continue
+            _write_feather(table, _feather_cache_path(entry.path))
+            converted += 1
+    return converted
+
+
+def numeric_diff_mask(a, b):
+    """
+    标记两组数值中超出容差的位置，任一边为 NaN 的位置不算差异
+
+    等价于 非NaN掩码 & ~np.isclose(a, b, rtol, atol, equal_nan=True)，但只做一次融合运算：
+    NaN 参与比较结果为 False，同号无穷相减得 NaN 也为 False，与 isclose 的判定一致
+    """
+    with np.errstate(invalid="ignore"):
+        mask = np.abs(a - b) > DIFF_ATOL + DIFF_RTOL * np.abs(b)
+        # b 为无穷时容差也是无穷，需单独判定：a 非 NaN 且与 b 不相等即为差异
+        inf_b = np.isinf(b)
+        if inf_b.any():
+            mask |= inf_b & (a != b) & ~np.isnan(a)
+    return mask
+
+
+_numba_kernel_ok = njit is not None  # numba 内核本进程内是否可用，编译或运行失败后置为 False
+
+if njit is not None:
+
+    # 不用 cache=True：磁盘缓存写在源码目录的 __pycache__ 中，缓存失效时会导致每次对比都出错
+    @njit
+    def _numeric_diff_counts_kernel(a, b, atol, rtol):
+        """逐列统计超出容差的个数，判定规则与 numeric_diff_mask 相同，不产生中间数组"""
+        n_rows, n_cols = a.shape
+        counts = np.zeros(n_cols, dtype=np.int64)
+        for j in range(n_cols):
+            count = 0
+            for i in range(n_rows):
+                x = a[i, j]
+                y = b[i, j]
+                if np.isinf(y):
+                    if x == x and x != y:
+                        count += 1
+                elif abs(x - y) > atol + rtol * abs(y):
+                    count += 1
+            counts[j] = count
+        return counts
+
+
+def numeric_diff_counts(a, b):
+    """
+    统计每列超出容差的个数（任一边为 NaN 的位置不算差异）
+
+    装了 numba 时用编译好的单次遍历内核，否则退回 numeric_diff_mask 再按列求和；
+    内核编译或运行失败时本进程改用 numeric_diff_mask，不让环境问题变成对比错误
+    """
+    global _numba_kernel_ok
+    if _numba_kernel_ok:
+        try:
+            return _numeric_diff_counts_kernel(a, b, DIFF_ATOL, DIFF_RTOL)
+        except Exception as e:
+            _numba_kernel_ok = False
+            print(f"numba 内核不可用，改用 numpy 计算: {e}")
+    return numeric_diff_mask(a, b).sum(axis=0)
 
 
 def compare_csv_files(file1_path, file2_path):
@@ -18,9 +214,13 @@ def compare_csv_files(file1_path, file2_path):
     比较两个CSV文件的内容，自动截取相同的时间范围
     """
     try:
+        # 逐字节相同的文件无需解析（先比大小，再分块比较，遇到不同立即停止）
+        if filecmp.cmp(file1_path, file2_path, shallow=False):
+            return True, "完全一致"
+
         # 读取两个CSV文件
-        df1 = pd.read_csv(file1_path, encoding="utf-8")
-        df2 = pd.read_csv(file2_path, encoding="utf-8")
+        df1 = read_factor_csv(file1_path)
+        df2 = read_factor_csv(file2_path)
 
         # 检查列名是否一致
         if list(df1.columns) != list(df2.columns):
@@ -31,28 +231,24 @@ def compare_csv_files(file1_path, file2_path):
 
         # 如果有交易日期列，截取相同的时间范围
         if "交易日期" in df1.columns:
-            # 找到两个数据集的共同日期范围
-            dates1 = set(df1["交易日期"].astype(str))
-            dates2 = set(df2["交易日期"].astype(str))
-            common_dates = dates1.intersection(dates2)
+            # 直接在日期数组上求两边共同日期的行号，再按日期稳定排序
+            dates1 = df1["交易日期"].to_numpy()
+            dates2 = df2["交易日期"].to_numpy()
+            rows1 = np.flatnonzero(np.isin(dates1, dates2))
+            rows2 = np.flatnonzero(np.isin(dates2, dates1))
 
-            if len(common_dates) == 0:
+            if len(rows1) == 0:
                 return False, {
                     "type": "no_common_dates",
                     "overall_ratio": 1.2,  # 没有共同日期视为高优先级
                 }
 
-            # 截取共同日期的数据
-            df1 = df1[df1["交易日期"].astype(str).isin(common_dates)].reset_index(
-                drop=True
-            )
-            df2 = df2[df2["交易日期"].astype(str).isin(common_dates)].reset_index(
-                drop=True
-            )
+            rows1 = rows1[np.argsort(dates1[rows1], kind="stable")]
+            rows2 = rows2[np.argsort(dates2[rows2], kind="stable")]
 
-            # 按日期排序保证一致性
-            df1 = df1.sort_values("交易日期").reset_index(drop=True)
-            df2 = df2.sort_values("交易日期").reset_index(drop=True)
+            # 截取共同日期的数据，只拷贝一次（同一日期有重复行时各自保留，行数不同会在下面判为形状不匹配）
+            df1 = df1.take(rows1).reset_index(drop=True)
+            df2 = df2.take(rows2).reset_index(drop=True)
 
         # 现在检查形状是否一致
         if df1.shape != df2.shape:
@@ -67,31 +263,24 @@ def compare_csv_files(file1_path, file2_path):
         numeric_cols = df1.select_dtypes(include=["number"]).columns
 
         if len(numeric_cols) > 0:
-            differences = 0
-            total_values = 0
-            diff_details = []
-
-            for col in numeric_cols:
-                valid_mask = ~pd.isna(df1[col]) & ~pd.isna(df2[col])
-                col_diff = valid_mask & ~np.isclose(
-                    df1[col], df2[col], rtol=1e-10, atol=1e-10, equal_nan=True
-                )
-                col_diff_count = col_diff.sum()
-
-                if col_diff_count > 0:
-                    col_total = len(df1[col])
-                    diff_ratio = col_diff_count / col_total
-                    diff_details.append(
-                        {
-                            "column": col,
-                            "diff_count": col_diff_count,
-                            "total_count": col_total,
-                            "diff_ratio": diff_ratio,
-                        }
-                    )
-
-                differences += col_diff_count
-                total_values += len(df1[col])
+            # 数值列堆成一个二维数组一次比较，按列统计差异数
+            col_diff_counts = numeric_diff_counts(
+                df1[numeric_cols].to_numpy(dtype=np.float64),
+                df2[numeric_cols].to_numpy(dtype=np.float64),
+            )
+            col_total = len(df1)
+            differences = col_diff_counts.sum()
+            total_values = col_total * len(numeric_cols)
+            diff_details = [
+                {
+                    "column": col,
+                    "diff_count": col_diff_count,
+                    "total_count": col_total,
+                    "diff_ratio": col_diff_count / col_total,
+                }
+                for col, col_diff_count in zip(numeric_cols, col_diff_counts)
+                if col_diff_count > 0
+            ]
 
             if differences > 0:
                 overall_ratio = differences / total_values
@@ -123,13 +312,64 @@ def compare_csv_files(file1_path, file2_path):
         }
 
 
-def find_all_differences(folder1, folder2):
+def _is_error_result(result):
+    """compare_csv_files 的结果是否为对比过程出错（而不是文件有差异）"""
+    _, info = result
+    return isinstance(info, dict) and info.get("type") == "error"
+
+
+def _compare_pair(item):
+    """进程池任务：比较一对文件，连同序号返回，便于按原顺序收集结果"""
+    i, (file1_path, file2_path) = item
+    return i, compare_csv_files(file1_path, file2_path)
+
+
+def _compare_cache_path(folder1, folder2):
+    """对比结果缓存文件路径，由缓存版本、两个文件夹的绝对路径和容差决定"""
+    key = (
+        f"v{COMPARE_CACHE_VERSION}\n{os.path.abspath(folder1)}\n"
+        f"{os.path.abspath(folder2)}\n{DIFF_RTOL}/{DIFF_ATOL}"
+    )
+    return os.path.join(
+        COMPARE_CACHE_DIR, hashlib.md5(key.encode("utf-8")).hexdigest() + ".pkl"
+    )
+
+
+def _load_compare_cache(cache_path):
+    """读取对比结果缓存 {(文件名1, 文件名2): ((文件1标记, 文件2标记), 对比结果)}，不存在或读不出时返回空字典"""
+    return load_pickle_cache(cache_path, {})
+
+
+def _save_compare_cache(cache_path, cache):
+    """保存对比结果缓存，失败只提示不影响报告"""
+    try:
+        save_pickle_cache(cache_path, cache)
+    except Exception as e:
+        print(f"保存对比缓存失败: {e}")
+
+
+def _file_stamp(path):
+    """文件的 (修改时间, 大小)，两者都没变时视为内容未变"""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _list_csv_files(folder):
+    """单次 os.scandir 列出文件夹中的CSV文件（按目录顺序）"""
+    with os.scandir(folder) as entries:
+        return [Path(entry.path) for entry in entries if entry.name.endswith(".csv")]
+
+
+def find_all_differences(folder1, folder2, use_cache=True):
     """
     找出所有有差异的文件
 
+    两个文件的修改时间和大小都与上次一致时直接复用缓存的对比结果，重跑只对比有变化的文件
+
     Args:
         folder1 (str): 第一个文件夹路径
         folder2 (str): 第二个文件夹路径
+        use_cache (bool): 是否复用上次的对比结果
     """
     original_folder = folder1
     new_folder = folder2
@@ -141,20 +381,17 @@ def find_all_differences(folder1, folder2):
         print("文件夹不存在")
         return
 
-    # 获取所有CSV文件
-    original_files = {f.name: f for f in original_path.glob("*.csv")}
-    new_files = {f.name: f for f in new_path.glob("*.csv")}
+    # 获取所有CSV文件（每个文件夹只扫描一次）
+    original_files_list = _list_csv_files(original_path)
+    new_files_list = _list_csv_files(new_path)
 
     # 根据股票代码匹配文件（支持不同日期）
     def extract_stock_code(filename):
         """从文件名中提取股票代码"""
         # 文件名格式: 000001.XSHE-平安银行-日线后复权及常用指标-20250818.csv
-        return filename.split("-")[0]  # 获取股票代码部分
+        return filename.partition("-")[0]  # 获取股票代码部分（遇到第一个"-"即停止）
 
     # 按股票代码分组
-    original_files_list = list(original_path.glob("*.csv"))
-    new_files_list = list(new_path.glob("*.csv"))
-
     print(f"第一个文件夹文件数: {len(original_files_list)}")
     print(f"第二个文件夹文件数: {len(new_files_list)}")
 
@@ -164,29 +401,60 @@ def find_all_differences(folder1, folder2):
     print(f"第一个文件夹股票代码数: {len(original_by_code)}")
     print(f"第二个文件夹股票代码数: {len(new_by_code)}")
 
-    # 找到共同股票代码的文件
-    common_files = []
-    for stock_code in original_by_code.keys():
-        if stock_code in new_by_code:
-            common_files.append(
-                (original_by_code[stock_code].name, new_by_code[stock_code].name)
-            )
+    # 找到共同股票代码的文件，直接取按代码索引的路径
+    pairs = [
+        (original_by_code[stock_code], new_by_code[stock_code])
+        for stock_code in original_by_code
+        if stock_code in new_by_code
+    ]
+    common_files = [(p1.name, p2.name) for p1, p2 in pairs]
 
     print(f"总共找到 {len(common_files)} 个共同文件")
 
-    # 检查所有文件的差异
+    # 检查所有文件的差异（多进程并行，结果按原顺序收集）
     different_files = []
     identical_files = 0
 
-    for i, (filename1, filename2) in enumerate(common_files, 1):
-        if i % 100 == 0:
-            print(f"检查进度: {i}/{len(common_files)}")
-
-        file1_path = original_files[filename1]
-        file2_path = new_files[filename2]
+    results = [None] * len(pairs)
+    stamps = [(_file_stamp(p1), _file_stamp(p2)) for p1, p2 in pairs]
 
-        is_identical, result = compare_csv_files(file1_path, file2_path)
+    cache_path = _compare_cache_path(original_folder, new_folder)
+    cache = _load_compare_cache(cache_path) if use_cache else {}
+    todo = []
+    for i, names in enumerate(common_files):
+        cached = cache.get(names)
+        if cached is not None and cached[0] == stamps[i]:
+            results[i] = cached[1]
+        else:
+            todo.append(i)
+    if len(todo) < len(pairs):
+        print(f"复用缓存结果: {len(pairs) - len(todo)} 个，需要重新对比: {len(todo)} 个")
+
+    if todo:
+        workers = min(COMPARE_WORKERS, len(todo))
+        chunksize = max(1, min(COMPARE_CHUNKSIZE, len(todo) // (workers * 4)))
+        with multiprocessing.Pool(workers) as pool:
+            for i, result in tqdm(
+                pool.imap_unordered(
+                    _compare_pair, [(i, pairs[i]) for i in todo], chunksize=chunksize
+                ),
+                total=len(todo),
+                desc="检查",
+                unit="个",
+            ):
+                results[i] = result
+
+    # 出错的结果不缓存：读取失败等往往是环境问题，修复后重跑应重新对比
+    _save_compare_cache(
+        cache_path,
+        {
+            names: (stamps[i], results[i])
+            for i, names in enumerate(common_files)
+            if not _is_error_result(results[i])
+        },
+    )
 
+    for (filename1, filename2), (is_identical, result) in zip(common_files, results):
         if not is_identical:
             # 提取股票代码作为标识
             stock_code = extract_stock_code(filename1)
@@ -209,6 +477,12 @@ def find_all_differences(folder1, folder2):
 
     # 生成报告内容
     report_lines = []
+
+    def tee(line):
+        """同一行既输出到控制台，又记入报告"""
+        print(line)
+        report_lines.append(line)
+
     report_lines.append(f"米筐隔日数据下载对比报告")
     report_lines.append(f"=" * 60)
     report_lines.append(f"生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
@@ -229,27 +503,31 @@ def find_all_differences(folder1, folder2):
     report_lines.append("")
 
     # 添加差异指标说明文档
-    report_lines.append("差异指标说明文档")
-    report_lines.append("=" * 60)
-    report_lines.append("")
-    report_lines.append("总体差异 (Overall Difference)")
-    report_lines.append("格式: 差异数据点/总数据点 (差异比例)")
-    report_lines.append("示例: 2,186/33,500 (0.065254)")
-    report_lines.append("含义:")
-    report_lines.append("  - 2,186 = 整个CSV文件中有差异的数据点数量")
-    report_lines.append("  - 33,500 = 整个CSV文件的总数据点数量 (行数 × 列数)")
-    report_lines.append("  - 0.065254 = 差异比例 = 2,186 ÷ 33,500 = 6.5%")
-    report_lines.append("")
-    report_lines.append("具体差异列 (Column-wise Differences)")
-    report_lines.append("格式: 列名: 差异数据点/该列总数据点 (该列差异比例)")
-    report_lines.append("示例: 自由流通股本: 1,093/1,340 (0.815672)")
-    report_lines.append("含义:")
-    report_lines.append("  - 1,093 = 该列中有差异的数据点数量")
-    report_lines.append("  - 1,340 = 该列的总数据点数量 (交易日数量)")
-    report_lines.append("  - 0.815672 = 该列差异比例 = 1,093 ÷ 1,340 = 81.6%")
-    report_lines.append("")
-    report_lines.append("=" * 60)
-    report_lines.append("")
+    report_lines.extend(
+        [
+            "差异指标说明文档",
+            "=" * 60,
+            "",
+            "总体差异 (Overall Difference)",
+            "格式: 差异数据点/总数据点 (差异比例)",
+            "示例: 2,186/33,500 (0.065254)",
+            "含义:",
+            "  - 2,186 = 整个CSV文件中有差异的数据点数量",
+            "  - 33,500 = 整个CSV文件的总数据点数量 (行数 × 列数)",
+            "  - 0.065254 = 差异比例 = 2,186 ÷ 33,500 = 6.5%",
+            "",
+            "具体差异列 (Column-wise Differences)",
+            "格式: 列名: 差异数据点/该列总数据点 (该列差异比例)",
+            "示例: 自由流通股本: 1,093/1,340 (0.815672)",
+            "含义:",
+            "  - 1,093 = 该列中有差异的数据点数量",
+            "  - 1,340 = 该列的总数据点数量 (交易日数量)",
+            "  - 0.815672 = 该列差异比例 = 1,093 ÷ 1,340 = 81.6%",
+            "",
+            "=" * 60,
+            "",
+        ]
+    )
 
     # 输出到控制台
     print(f"\n检查完成!")
@@ -258,8 +536,7 @@ def find_all_differences(folder1, folder2):
 
     if different_files:
         # 先显示前5名差异最大的股票
-        print("差异最大的前5名股票 (重点关注):")
-        report_lines.append("差异最大的前5名股票 (重点关注):")
+        tee("差异最大的前5名股票 (重点关注):")
         report_lines.append("=" * 60)
         report_lines.append("")
 
@@ -282,56 +559,31 @@ def find_all_differences(folder1, folder2):
             report_lines.append(f"【TOP {i}】{diff_file['stock_code']}")
 
             if diff_info["type"] == "numeric_diff":
-                console_output = f"  • 差异类型: 数值差异"
-                print(console_output)
-                report_lines.append(console_output)
-
-                console_output = f"  • 总体差异: {diff_info['overall_diff']:,}/{diff_info['overall_total']:,} ({diff_info['overall_ratio']:.4f} = {diff_info['overall_ratio']*100:.2f}%)"
-                print(console_output)
-                report_lines.append(console_output)
-
-                console_output = f"  • 主要差异列:"
-                print(console_output)
-                report_lines.append(console_output)
+                tee(f"  • 差异类型: 数值差异")
+                tee(f"  • 总体差异: {diff_info['overall_diff']:,}/{diff_info['overall_total']:,} ({diff_info['overall_ratio']:.4f} = {diff_info['overall_ratio']*100:.2f}%)")
+                tee(f"  • 主要差异列:")
 
                 # 只显示前3个差异最大的列
-                sorted_cols = sorted(
-                    diff_info["column_details"],
-                    key=lambda x: x["diff_ratio"],
-                    reverse=True,
-                )[:3]
+                sorted_cols = heapq.nlargest(
+                    3, diff_info["column_details"], key=itemgetter("diff_ratio")
+                )
                 for col_detail in sorted_cols:
-                    console_output = f"    - {col_detail['column']}: {col_detail['diff_ratio']*100:.2f}% ({col_detail['diff_count']:,}/{col_detail['total_count']:,})"
-                    print(console_output)
-                    report_lines.append(console_output)
+                    tee(f"    - {col_detail['column']}: {col_detail['diff_ratio']*100:.2f}% ({col_detail['diff_count']:,}/{col_detail['total_count']:,})")
 
             elif diff_info["type"] == "no_common_dates":
-                console_output = f"  • 差异类型: 无共同交易日期 (可能已退市)"
-                print(console_output)
-                report_lines.append(console_output)
+                tee(f"  • 差异类型: 无共同交易日期 (可能已退市)")
 
             elif diff_info["type"] == "column_mismatch":
-                console_output = f"  • 差异类型: 列名不匹配"
-                print(console_output)
-                report_lines.append(console_output)
+                tee(f"  • 差异类型: 列名不匹配")
 
             elif diff_info["type"] == "shape_mismatch":
-                console_output = f"  • 差异类型: 形状不匹配"
-                print(console_output)
-                report_lines.append(console_output)
+                tee(f"  • 差异类型: 形状不匹配")
 
             elif diff_info["type"] == "error":
-                console_output = f"  • 差异类型: 处理错误"
-                print(console_output)
-                report_lines.append(console_output)
-
-            console_output = f"  • 文件: {diff_file['filename1']}"
-            print(console_output)
-            report_lines.append(console_output)
+                tee(f"  • 差异类型: 处理错误")
 
-            console_output = f"         vs {diff_file['filename2']}"
-            print(console_output)
-            report_lines.append(console_output)
+            tee(f"  • 文件: {diff_file['filename1']}")
+            tee(f"         vs {diff_file['filename2']}")
             report_lines.append("")
 
         print("\n" + "=" * 60)
@@ -339,74 +591,38 @@ def find_all_differences(folder1, folder2):
         report_lines.append("")
 
         # 再显示完整的排序列表
-        print("所有差异文件完整列表 (按差异程度排序):")
-        report_lines.append("所有差异文件完整列表 (按差异程度排序):")
+        tee("所有差异文件完整列表 (按差异程度排序):")
         report_lines.append("=" * 60)
 
         for i, diff_file in enumerate(different_files, 1):
             diff_info = diff_file["diff_info"]
 
-            # 控制台输出
-            print(f"\n{i}. 股票代码: {diff_file['stock_code']}")
-
-            # 报告输出
-            report_lines.append(f"\n{i}. 股票代码: {diff_file['stock_code']}")
+            tee(f"\n{i}. 股票代码: {diff_file['stock_code']}")
 
             if diff_info["type"] == "numeric_diff":
-                console_output = f"    差异类型: 数值差异"
-                print(console_output)
-                report_lines.append(console_output)
-
-                console_output = f"    总体差异: {diff_info['overall_diff']}/{diff_info['overall_total']} ({diff_info['overall_ratio']:.6f})"
-                print(console_output)
-                report_lines.append(console_output)
-
-                console_output = f"    具体差异列:"
-                print(console_output)
-                report_lines.append(console_output)
+                tee(f"    差异类型: 数值差异")
+                tee(f"    总体差异: {diff_info['overall_diff']}/{diff_info['overall_total']} ({diff_info['overall_ratio']:.6f})")
+                tee(f"    具体差异列:")
 
                 for col_detail in diff_info["column_details"]:
-                    console_output = f"      - {col_detail['column']}: {col_detail['diff_count']}/{col_detail['total_count']} ({col_detail['diff_ratio']:.6f})"
-                    print(console_output)
-                    report_lines.append(console_output)
+                    tee(f"      - {col_detail['column']}: {col_detail['diff_count']}/{col_detail['total_count']} ({col_detail['diff_ratio']:.6f})")
 
             elif diff_info["type"] == "column_mismatch":
-                console_output = f"    差异类型: 列名不匹配"
-                print(console_output)
-                report_lines.append(console_output)
+                tee(f"    差异类型: 列名不匹配")
 
             elif diff_info["type"] == "shape_mismatch":
-                console_output = f"    差异类型: 形状不匹配"
-                print(console_output)
-                report_lines.append(console_output)
-
-                console_output = (
-                    f"    形状: {diff_info['shape1']} vs {diff_info['shape2']}"
-                )
-                print(console_output)
-                report_lines.append(console_output)
+                tee(f"    差异类型: 形状不匹配")
+                tee(f"    形状: {diff_info['shape1']} vs {diff_info['shape2']}")
 
             elif diff_info["type"] == "no_common_dates":
-                console_output = f"    差异类型: 没有共同的交易日期"
-                print(console_output)
-                report_lines.append(console_output)
+                tee(f"    差异类型: 没有共同的交易日期")
 
             elif diff_info["type"] == "error":
-                console_output = f"    差异类型: 错误"
-                print(console_output)
-                report_lines.append(console_output)
+                tee(f"    差异类型: 错误")
+                tee(f"    错误信息: {diff_info['message']}")
 
-                console_output = f"    错误信息: {diff_info['message']}"
-                print(console_output)
-                report_lines.append(console_output)
-
-            console_output = f"    文件: {diff_file['filename1']}"
-            print(console_output)
-            report_lines.append(console_output)
-
-            console_output = f"          vs {diff_file['filename2']}"
-            print(console_output)
-            report_lines.append(console_output)
+            tee(f"    文件: {diff_file['filename1']}")
+            tee(f"          vs {diff_file['filename2']}")
 
     # 保存报告到文件
     # 使用完整的文件夹名来命名
@@ -414,10 +630,8 @@ def find_all_differences(folder1, folder2):
     folder2_name = os.path.basename(new_folder)
 
     # 从文件夹名中提取日期部分（找到8位数字）
-    import re
-
-    folder1_date_match = re.search(r"(\d{8})", folder1_name)
-    folder2_date_match = re.search(r"(\d{8})", folder2_name)
+    folder1_date_match = FOLDER_DATE_RE.search(folder1_name)
+    folder2_date_match = FOLDER_DATE_RE.search(folder2_name)
 
     folder1_date = folder1_date_match.group(1) if folder1_date_match else "unknown"
     folder2_date = folder2_date_match.group(1) if folder2_date_match else "unknown"
@@ -437,8 +651,7 @@ def find_all_differences(folder1, folder2):
 
     try:
         with open(report_path, "w", encoding="utf-8") as f:
-            for line in report_lines:
-                f.write(line + "\n")
+            f.write("\n".join(report_lines) + "\n")
         print(f"\n对比报告已保存到: {report_path}")
     except Exception as e:
         print(f"\n保存报告时发生错误: {e}")
@@ -458,9 +671,17 @@ def main():
         "/Users/didi/KDCJ/deep_model/data/enhanced/enhanced_factors_csv_20250902_test"
     )
 
+    # 反复对比同一批文件时设为 True，先转换为 Feather，之后的对比内存映射读取
+    convert_to_feather = False
+
     print(f"第一个文件夹: {folder1_path}")
     print(f"第二个文件夹: {folder2_path}")
 
+    if convert_to_feather:
+        for folder in (folder1_path, folder2_path):
+            converted = convert_folder_to_feather(folder)
+            print(f"已转换 {converted} 个文件为 Feather: {folder}")
+
     different_files = find_all_differences(folder1_path, folder2_path)
 
 
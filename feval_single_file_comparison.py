@@ -5,7 +5,6 @@
 """
 
 import os
-import pandas as pd
 import numpy as np
 from pathlib import Path
 import sys
@@ -13,12 +12,16 @@ import sys
 # 添加项目配置路径
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
 from deep_model.config.paths import ENHANCED_DATA_DIR
+from feval_folder_file_comparison import numeric_diff_mask, read_factor_csv
 
 # ==================== 快速配置区域 ====================
 # 直接在这里设置要对比的两个文件路径，然后运行此文件即可
 QUICK_COMPARE_FILE1 = "/Users/didi/KDCJ/deep_model/data/enhanced/enhanced_factors_csv_20250902_test/000002.XSHE-万科A-日线后复权及常用指标-20250901.csv"
 QUICK_COMPARE_FILE2 = "/Users/didi/KDCJ/deep_model/data/enhanced/enhanced_factors_csv_20250902/000002.XSHE-万科A-日线后复权及常用指标-20250901.csv"
 
+# 反复调试同一对文件时设为 True：首次解析后写出 Feather 缓存（在缓存目录中，不写在CSV旁），之后内存映射读取
+QUICK_CACHE_FEATHER = False
+
 # 要对比的文件路径（修改这两个路径，然后运行此文件即可）
 # ====================================================
 
@@ -31,9 +34,9 @@ def detailed_compare_files(file1_path, file2_path):
     print("=" * 80)
 
     try:
-        # 读取两个CSV文件
-        df1 = pd.read_csv(file1_path, encoding="utf-8")
-        df2 = pd.read_csv(file2_path, encoding="utf-8")
+        # 读取两个CSV文件（开启 QUICK_CACHE_FEATHER 时首次解析后缓存为 Feather）
+        df1 = read_factor_csv(file1_path, cache_feather=QUICK_CACHE_FEATHER)
+        df2 = read_factor_csv(file2_path, cache_feather=QUICK_CACHE_FEATHER)
 
         print(f"文件1形状: {df1.shape}")
         print(f"文件2形状: {df2.shape}")
@@ -55,12 +58,14 @@ def detailed_compare_files(file1_path, file2_path):
         total_differences = 0
         total_values = 0
 
-        for col in numeric_cols:
-            # 找出有差异的行
-            valid_mask = ~pd.isna(df1[col]) & ~pd.isna(df2[col])
-            col_diff = valid_mask & ~np.isclose(
-                df1[col], df2[col], rtol=1e-10, atol=1e-10, equal_nan=True
-            )
+        # 数值列堆成一个二维数组一次比较，找出有差异的位置
+        diff_mask = numeric_diff_mask(
+            df1[numeric_cols].to_numpy(dtype=np.float64),
+            df2[numeric_cols].to_numpy(dtype=np.float64),
+        )
+
+        for j, col in enumerate(numeric_cols):
+            col_diff = diff_mask[:, j]
 
             if col_diff.any():
                 diff_count = col_diff.sum()
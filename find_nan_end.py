@@ -13,6 +13,7 @@
     print(f"第一个非 NaN 的行号: {result['first_non_nan_index']}")
 """
 
+import numpy as np
 import pandas as pd
 import sys
 
@@ -42,13 +43,13 @@ def find_nan_end(df, column_name):
         print(f"可用的列：{list(df.columns)}")
         return None
     
-    # 获取该列
-    col = df[column_name]
+    # 获取该列的 NaN 掩码，后续统计都基于这一个数组，不再反复扫描整列
+    nan_mask = df[column_name].isna().to_numpy()
     
     # 统计信息
     total_rows = len(df)
-    nan_count = col.isna().sum()
-    non_nan_count = col.notna().sum()
+    nan_count = nan_mask.sum()
+    non_nan_count = total_rows - nan_count
     
     print(f"【1. 基本统计】")
     print("-" * 100)
@@ -58,11 +59,11 @@ def find_nan_end(df, column_name):
     print()
     
     # 找到第一个非 NaN 的位置
-    first_non_nan_idx = col.first_valid_index()
-    
-    if first_non_nan_idx is None:
+    if non_nan_count == 0:
         print("❌ 该列全部都是 NaN！")
         return None
+    first_pos = nan_mask.argmin()
+    first_non_nan_idx = df.index[first_pos]
     
     print(f"【2. 第一个非 NaN 值的位置】")
     print("-" * 100)
@@ -115,14 +116,15 @@ def find_nan_end(df, column_name):
     print("-" * 100)
     
     # 从第一个非 NaN 开始，检查后续是否还有 NaN
-    remaining_nans = col.loc[first_non_nan_idx:].isna().sum()
+    tail_mask = nan_mask[first_pos:]
+    remaining_nans = tail_mask.sum()
     
     if remaining_nans > 0:
         print(f"⚠️  警告：在第一个非 NaN 值之后，还有 {remaining_nans} 个 NaN 值")
         print("这可能表示数据不连续或有缺失")
         
         # 找到这些 NaN 的位置
-        nan_indices = col.loc[first_non_nan_idx:][col.loc[first_non_nan_idx:].isna()].index.tolist()
+        nan_indices = df.index[first_pos + np.flatnonzero(tail_mask)].tolist()
         if len(nan_indices) <= 10:
             print(f"这些 NaN 的行号: {nan_indices}")
         else:
@@ -161,33 +163,38 @@ def check_all_columns_nan(df, columns=None):
     if columns is None:
         columns = df.columns.tolist()
     
+    columns = [col for col in columns if col in df.columns]
+    
+    # 所有列的 NaN 掩码一次算出，再按列归约，不逐列调用 isna / first_valid_index
+    nan_mask = df[columns].isna().to_numpy()
+    valid_mask = ~nan_mask
+    total = len(df)
+    nan_counts = nan_mask.sum(axis=0)
+    has_valid = valid_mask.any(axis=0)
+    first_positions = valid_mask.argmax(axis=0) if total else has_valid.astype(int)
+    
+    # 获取日期信息（如果有）
+    if "交易日期" in df.columns:
+        dates = df["交易日期"].array
+    elif "date" in df.columns:
+        dates = df["date"].array
+    else:
+        dates = None
+    
     results = []
     
-    for col in columns:
-        if col not in df.columns:
-            continue
-        
-        col_data = df[col]
-        total = len(df)
-        nan_count = col_data.isna().sum()
-        non_nan_count = col_data.notna().sum()
-        first_valid_idx = col_data.first_valid_index()
-        
-        # 获取日期信息（如果有）
-        first_date = None
-        if first_valid_idx is not None:
-            if "交易日期" in df.columns:
-                first_date = df.loc[first_valid_idx, "交易日期"]
-            elif "date" in df.columns:
-                first_date = df.loc[first_valid_idx, "date"]
+    for col, nan_count, valid, first_pos in zip(
+        columns, nan_counts, has_valid, first_positions
+    ):
+        first_date = dates[first_pos] if valid and dates is not None else None
         
         results.append({
             "列名": col,
             "总行数": total,
             "NaN数量": nan_count,
             "NaN占比(%)": round(nan_count / total * 100, 2),
-            "非NaN数量": non_nan_count,
-            "第一个非NaN行号": first_valid_idx if first_valid_idx is not None else "全部NaN",
+            "非NaN数量": total - nan_count,
+            "第一个非NaN行号": df.index[first_pos] if valid else "全部NaN",
             "第一个非NaN日期": first_date if first_date else "-"
         })
     
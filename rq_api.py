@@ -4,21 +4,61 @@
 将所有米筐API的导入集中在这里，使项目独立于 factor_utils
 """
 
+import os
 import warnings
+import functools
+import pandas as pd
 from loguru import logger
 
-# 过滤米筐API的警告信息
-warnings.filterwarnings("ignore")
+from config import CACHE_DIR
+from data_utils import load_pickle_cache, save_pickle_cache
 
-# 导入米筐API
-from rqdatac import *
-from rqfactor import *
-from rqfactor import Factor
-from rqfactor.extension import *
+# 只过滤已知的噪音警告；项目自身代码触发的其他警告（如因子计算中的除零、
+# 空切片 RuntimeWarning，pandas 的弃用提示）照常显示，便于发现真正的问题。
+# pandas/numpy 把警告归属到调用方模块，按 module 过滤它们的警告不会生效，只能按类别和消息匹配
+warnings.filterwarnings("ignore", module=r"rq(datac|factor)(\.|$)")  # 米筐SDK内部发出的提示
+warnings.filterwarnings(
+    "ignore",
+    message="DataFrame is highly fragmented",
+    category=pd.errors.PerformanceWarning,
+)  # 逐列插入因子列时的碎片化提示
+
+# 导入米筐API（只导入项目实际用到的接口，计算进程启动时不再导入整个 rqfactor）
+from rqdatac import (
+    init,
+    instruments,
+    get_price,
+    get_turnover_rate,
+    get_shares,
+    get_vwap,
+    get_capital_flow,
+    get_factor,
+    get_holder_number,
+)
+
+# 对外提供的接口：本模块的函数和转出的米筐API（计算模块统一从这里导入）
+__all__ = [
+    "init_rq_api",
+    "is_initialized",
+    "get_instrument",
+    "get_instruments",
+    "prime_instrument_cache",
+    "INSTRUMENT_CACHE_DIR",
+    "instruments",
+    "get_price",
+    "get_turnover_rate",
+    "get_shares",
+    "get_vwap",
+    "get_capital_flow",
+    "get_factor",
+    "get_holder_number",
+]
 
 # 米筐API初始化标志
 _rq_initialized = False
 
+INSTRUMENT_CACHE_DIR = os.path.join(CACHE_DIR, "instruments")  # 按日期保存的合约信息缓存目录
+
 
 def init_rq_api(username="13522652015", password="123456"):
     """
@@ -50,3 +90,80 @@ def init_rq_api(username="13522652015", password="123456"):
 def is_initialized():
     """检查米筐API是否已初始化"""
     return _rq_initialized
+
+
+@functools.lru_cache(maxsize=8192)
+def get_instrument(order_book_id):
+    """
+    获取单只股票的合约信息（上市日期、简称等），进程内缓存
+
+    合约信息是静态元数据，同一进程内同一股票只请求一次米筐。
+    参数只接受字符串代码，保证缓存键可哈希。
+
+    Args:
+        order_book_id: 股票代码，如 000001.XSHE
+
+    Returns:
+        Instrument: 合约信息，找不到时为 None
+    """
+    return instruments(order_book_id)
+
+
+def _instrument_cache_path(date):
+    """某个数据日期的合约信息缓存文件路径"""
+    return os.path.join(INSTRUMENT_CACHE_DIR, f"instruments_{date}.pkl")
+
+
+def _read_instrument_cache(date):
+    """读取磁盘上的合约信息缓存 {代码: Instrument}，不存在或读不出时返回空字典"""
+    return load_pickle_cache(_instrument_cache_path(date), {})
+
+
+def prime_instrument_cache(order_book_ids, date):
+    """
+    在主进程中一次取回所有股票的合约信息，写入当日的磁盘缓存
+
+    计算进程通过 get_instruments 读取缓存，不必每块股票各请求一次米筐；
+    缓存中已有的股票不再请求，取数或写盘失败时只记录警告（计算进程会退回直接请求）
+
+    Args:
+        order_book_ids: 股票代码列表
+        date: 数据日期（YYYYMMDD），合约信息（如股票简称）可能变化，按日期分别缓存
+    """
+    cached = _read_instrument_cache(date)
+    missing = [c for c in order_book_ids if c not in cached]
+    if not missing:
+        return
+
+    cache_path = _instrument_cache_path(date)
+    try:
+        cached.update({ins.order_book_id: ins for ins in instruments(missing) or []})
+        save_pickle_cache(cache_path, cached)
+        logger.info(f"已缓存 {len(cached)} 只股票的合约信息: {cache_path}")
+    except Exception as e:
+        logger.warning(f"缓存合约信息失败，计算进程将直接请求米筐: {e}")
+
+
+@functools.lru_cache(maxsize=4)
+def _load_instrument_cache(date):
+    """进程内只读一次当日的合约信息缓存"""
+    return _read_instrument_cache(date)
+
+
+def get_instruments(order_book_ids, date):
+    """
+    批量获取合约信息，优先使用 prime_instrument_cache 写好的当日缓存，缓存中没有的再请求米筐
+
+    Returns:
+        dict: {代码: Instrument}，按输入顺序排列，找不到的股票不在其中
+    """
+    cached = _load_instrument_cache(date)
+    missing = [c for c in order_book_ids if c not in cached]
+    fetched = {}
+    if missing:
+        fetched = {ins.order_book_id: ins for ins in instruments(missing) or []}
+    return {
+        c: cached[c] if c in cached else fetched[c]
+        for c in order_book_ids
+        if c in cached or c in fetched
+    }
@@ -14,28 +14,49 @@ from loguru import logger
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # 导入配置和处理模块
-from config import RAW_DATA_DIR, ENHANCED_DATA_DIR, DATA_ROOT
+from config import (
+    RAW_DATA_DIR,
+    ENHANCED_DATA_DIR,
+    DATA_ROOT,
+    MAX_WORKERS,
+    OUTPUT_FORMAT,
+)
 from batch_processor import (
+    OUTPUT_FORMATS,
+    RETRY_QPS,
+    RETRY_WORKERS,
+    dry_run_check,
     run_parallel_stock_processing,
     retry_failed_stocks,
     _process_single_stock,
 )
+from data_utils import add_log_file_sink, format_error
+
 
+def get_today_date(now=None):
+    """获取今天的日期 (YYYYMMDD格式)，now 为 None 时取当前时间"""
+    return (now or datetime.now()).strftime("%Y%m%d")
 
-def get_today_date():
-    """获取今天的日期 (YYYYMMDD格式)"""
-    return datetime.now().strftime("%Y%m%d")
 
+def positive_float(value):
+    """argparse 参数类型：大于0的浮点数"""
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"必须大于0: {value}")
+    return number
 
-def setup_logging():
-    """配置日志"""
+
+def setup_logging(started_at=None):
+    """配置日志，日志文件名带上任务启动时间"""
     log_dir = os.path.join(DATA_ROOT, "dnn_model", "logs")
     os.makedirs(log_dir, exist_ok=True)
 
+    started_at = started_at or datetime.now()
     log_file = os.path.join(
-        log_dir, f"factor_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+        log_dir, f"factor_{started_at.strftime('%Y%m%d_%H%M%S')}.log"
     )
-    logger.add(log_file, rotation="500 MB", retention="30 days", encoding="utf-8")
+    # 计算子进程会通过同一个函数把日志写入这个文件
+    add_log_file_sink(log_file)
     return log_file
 
 
@@ -49,36 +70,104 @@ if __name__ == "__main__":
         help="运行模式: batch=批量处理, single=单股测试, retry=重试失败",
     )
     parser.add_argument("--limit", type=int, default=None, help="限制股票数量")
-    parser.add_argument("--workers", type=int, default=4, help="线程数")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help=(
+            "并行数：批量模式为计算进程数，默认取 config.MAX_WORKERS（按米筐并发配额调整）；"
+            f"重试模式为重试线程数，默认 {RETRY_WORKERS}；0 表示按可用CPU核心数自动确定"
+        ),
+    )
     parser.add_argument("--stock", default="000001.XSHE", help="单股模式: 股票代码")
     parser.add_argument("--stock-name", default="平安银行", help="单股模式: 股票名称")
+    parser.add_argument(
+        "--format",
+        default=OUTPUT_FORMAT,
+        choices=OUTPUT_FORMATS,
+        help="输出格式: csv / feather / parquet，默认取 config.OUTPUT_FORMAT",
+    )
+    parser.add_argument(
+        "--staging",
+        action="store_true",
+        help="批量模式: 先写入内存暂存目录，结束后再整体拷贝到输出目录",
+    )
+    parser.add_argument(
+        "--aggregate",
+        action="store_true",
+        help="批量模式: 所有股票汇总写成一个按股票代码分区的 Parquet 数据集",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="批量模式: 清空输出目录后全部重算（默认跳过已有当日输出文件的股票）",
+    )
+    parser.add_argument(
+        "--float-format",
+        default=None,
+        help="CSV 浮点数格式(如 %%.6g)，默认保留完整精度",
+    )
+    parser.add_argument(
+        "--pin-workers",
+        action="store_true",
+        help="批量模式: 计算进程各绑定一个CPU核心（仅 Linux）",
+    )
+    parser.add_argument(
+        "--qps",
+        type=positive_float,
+        default=RETRY_QPS,
+        help="重试模式: 每秒最多开始处理的股票数（须大于0）",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="只检查原始数据目录和米筐连通性，不计算、不写文件",
+    )
 
     args = parser.parse_args()
 
-    log_file = setup_logging()
-    dataset_end_date = args.date if args.date else get_today_date()
+    # 只取一次启动时间：日志文件名与默认数据日期一致（跨零点启动时也不会错开一天）
+    started_at = datetime.now()
+    log_file = setup_logging(started_at)
+    dataset_end_date = args.date if args.date else get_today_date(started_at)
     data_dir = RAW_DATA_DIR
-    save_dir = f"{ENHANCED_DATA_DIR}_{dataset_end_date}"
-    os.makedirs(save_dir, exist_ok=True)
+    save_dir = f"{ENHANCED_DATA_DIR}_{dataset_end_date}"  # 批量和重试模式会自行创建
 
     logger.info(f"开始处理 {dataset_end_date} 的数据")
     logger.info(f"运行模式: {args.mode}")
     logger.warning(f"日志文件: {log_file}")
 
+    if args.dry_run:
+        logger.success("试运行：检查数据目录和米筐连通性")
+        ok = dry_run_check(
+            data_dir,
+            save_dir,
+            dataset_end_date,
+            limit=args.limit,
+            output_format=args.format,
+            aggregate=args.aggregate,
+        )
+        sys.exit(0 if ok else 1)
+
     try:
         # 执行相应的测试模式
         if args.mode == "single":
             # 测试单只股票
             logger.success("测试单只股票")
             stock_info = {"converted_code": args.stock, "stock_name": args.stock_name}
+            os.makedirs(save_dir, exist_ok=True)
             is_success, error_message = _process_single_stock(
-                stock_info, save_dir, dataset_end_date
+                stock_info,
+                save_dir,
+                dataset_end_date,
+                output_format=args.format,
+                float_format=args.float_format,
             )
             if is_success:
                 logger.success(f"✅ 股票 {args.stock}({args.stock_name}) 处理成功")
             else:
                 logger.error(
-                    f"❌ 股票 {args.stock}({args.stock_name}) 处理失败: {error_message}"
+                    f"❌ 股票 {args.stock}({args.stock_name}) 处理失败: {format_error(error_message)}"
                 )
 
         elif args.mode == "batch":
@@ -89,13 +178,26 @@ if __name__ == "__main__":
                 save_dir,
                 dataset_end_date,
                 limit=args.limit,
-                max_workers=args.workers,
+                max_workers=MAX_WORKERS if args.workers is None else args.workers,
+                output_format=args.format,
+                use_staging=args.staging,
+                aggregate=args.aggregate,
+                skip_existing=not args.force,
+                float_format=args.float_format,
+                pin_workers=args.pin_workers,
             )
 
         elif args.mode == "retry":
-            # 串行重试失败的股票
-            logger.success("串行重试处理失败的股票")
-            retry_failed_stocks(save_dir, dataset_end_date)
+            # 并行重试失败的股票
+            logger.success("并行重试处理失败的股票")
+            retry_failed_stocks(
+                save_dir,
+                dataset_end_date,
+                output_format=args.format,
+                qps=args.qps,
+                float_format=args.float_format,
+                max_workers=RETRY_WORKERS if args.workers is None else args.workers,
+            )
 
     except Exception as e:
         logger.error(f"处理失败: {e}")